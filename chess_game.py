@@ -1,11 +1,21 @@
 # run: python chess_game.py
-# requires: pip install pygame
+# requires: pip install pygame-ce
 
 import pygame
 import sys
+import os
 import copy
 import base64
 import io
+import json
+import time
+import random
+import re
+import argparse
+import sqlite3
+import multiprocessing
+from multiprocessing import connection, shared_memory
+from collections import OrderedDict
 
 # ---------------------------------------------------------------------------
 # Embedded chess-symbol font (12-glyph subset of Apple Symbols, ~4.5 KB)
@@ -111,7 +121,14 @@ STATUS_H    = 90                          # status bar at bottom
 WINDOW_W    = BOARD_PX                   # 640
 WINDOW_H    = TAB_H + BOARD_PX + STATUS_H # 774
 BOARD_Y     = TAB_H                      # y-pixel where board starts
-FPS         = 60
+FPS         = 60                          # frame rate while something animates
+IDLE_WAIT   = 1.0                         # s the loop may block on input otherwise
+
+# UI timers, in seconds; states keep perf_counter() deadlines for them
+HINT_SECONDS      = 3.0   # hint square after H
+CORRECT_SECONDS   = 1.0   # green square after a correct move
+FLASH_SECONDS     = 2.0   # red flash after a wrong move, then the puzzle resets
+NAV_POPUP_SECONDS = 1.5   # "completed" popup before moving to the next game
 
 # ---------------------------------------------------------------------------
 # Colours
@@ -132,7 +149,6 @@ C_TAB_LINE     = ( 90,  90,  90)
 C_PROMO_BG     = (255, 255, 255)
 C_PROMO_SEL    = (180, 220, 180)
 C_PROMO_BDR    = ( 80,  80,  80)
-C_BG           = ( 18,  18,  18)
 
 # ---------------------------------------------------------------------------
 # Chess symbols
@@ -216,81 +232,728 @@ GAMES = {
 
 
 # ---------------------------------------------------------------------------
-# Piece
+# Puzzle store
+# Entries live in SQLite, one row each, indexed by key, theme, rating and
+# move count; seq gives the navigation order.  Only the entries actually
+# shown are decoded, through a small LRU, so a pack of 100k+ puzzles costs
+# nothing at startup.  The built-in GAMES seed the default in-memory store.
+# The mining table records how many games of each PGN source the tactic
+# miner has finished, so an interrupted run picks up where it stopped.
+# ---------------------------------------------------------------------------
+PUZZLE_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS puzzles (
+    seq     INTEGER PRIMARY KEY,
+    key     TEXT    NOT NULL UNIQUE,
+    mode    TEXT    NOT NULL,
+    theme   TEXT    NOT NULL DEFAULT '',
+    rating  INTEGER,
+    n_moves INTEGER NOT NULL,
+    data    TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS puzzles_theme   ON puzzles (theme);
+CREATE INDEX IF NOT EXISTS puzzles_rating  ON puzzles (rating);
+CREATE INDEX IF NOT EXISTS puzzles_n_moves ON puzzles (n_moves);
+CREATE TABLE IF NOT EXISTS mining (
+    source  TEXT    PRIMARY KEY,
+    games   INTEGER NOT NULL
+);
+"""
+PUZZLE_CACHE_SIZE = 64
+
+
+def _decode_entry(data):
+    gm = json.loads(data)
+    # JSON has no tuples; move lists go back to the (from, to) pairs GAMES uses
+    for field in ('solution', 'moves'):
+        if field in gm:
+            gm[field] = [tuple(m) for m in gm[field]]
+    return gm
+
+
+class PuzzleStore:
+    """Puzzle/replay entries by key, backed by an SQLite file or ':memory:'."""
+
+    def __init__(self, path=':memory:'):
+        self.path   = path
+        self.db     = sqlite3.connect(path)
+        self.db.executescript(PUZZLE_DB_SCHEMA)
+        self._cache = OrderedDict()   # key -> (seq, entry)
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM puzzles").fetchone()[0]
+
+    def __contains__(self, key):
+        return self._row(key) is not None
+
+    def add_many(self, items):
+        """Insert or replace (key, entry) pairs in one transaction.  An existing
+        key keeps its place in the navigation order.  Returns the count."""
+        n = 0
+        with self.db:
+            for key, gm in items:
+                moves = gm.get('solution', gm.get('moves', ()))
+                self.db.execute(
+                    "INSERT INTO puzzles (key, mode, theme, rating, n_moves, data)"
+                    " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET"
+                    " mode = excluded.mode, theme = excluded.theme,"
+                    " rating = excluded.rating, n_moves = excluded.n_moves,"
+                    " data = excluded.data",
+                    (key, gm['mode'], gm.get('theme', ''), gm.get('rating'),
+                     len(moves), json.dumps(gm)))
+                self._cache.pop(key, None)
+                n += 1
+        return n
+
+    def import_games(self, games):
+        """Copy a GAMES-style {key: entry} dict into the store."""
+        return self.add_many(games.items())
+
+    def _row(self, key):
+        hit = self._cache.get(key)
+        if hit is not None:
+            self._cache.move_to_end(key)
+            return hit
+        row = self.db.execute("SELECT seq, data FROM puzzles WHERE key = ?",
+                              (key,)).fetchone()
+        if row is None:
+            return None
+        hit = self._cache[key] = (row[0], _decode_entry(row[1]))
+        if len(self._cache) > PUZZLE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return hit
+
+    def get(self, key):
+        """Entry dict for key; raises KeyError if there is none."""
+        hit = self._row(key)
+        if hit is None:
+            raise KeyError(key)
+        return hit[1]
+
+    def neighbours(self, key):
+        """(previous key, next key) in navigation order, None at either end.
+        Two primary-key range probes, independent of the store's size."""
+        seq = self._row(key)[0]
+        prev = self.db.execute("SELECT key FROM puzzles WHERE seq < ?"
+                               " ORDER BY seq DESC LIMIT 1", (seq,)).fetchone()
+        nxt  = self.db.execute("SELECT key FROM puzzles WHERE seq > ?"
+                               " ORDER BY seq LIMIT 1", (seq,)).fetchone()
+        return prev and prev[0], nxt and nxt[0]
+
+    def first_key(self):
+        row = self.db.execute("SELECT key FROM puzzles ORDER BY seq LIMIT 1").fetchone()
+        return row and row[0]
+
+    def keys(self, theme=None, min_rating=None, max_rating=None, n_moves=None):
+        """Iterate keys in navigation order, filtered on the indexed columns."""
+        where, params = [], []
+        for clause, value in (("theme = ?", theme), ("rating >= ?", min_rating),
+                              ("rating <= ?", max_rating), ("n_moves = ?", n_moves)):
+            if value is not None:
+                where.append(clause); params.append(value)
+        sql = "SELECT key FROM puzzles"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        for (key,) in self.db.execute(sql + " ORDER BY seq", params):
+            yield key
+
+    def items(self, mode=None):
+        """Stream (key, entry) in navigation order, bypassing the LRU; for
+        batch jobs that visit every entry once."""
+        sql    = "SELECT key, data FROM puzzles"
+        params = ()
+        if mode is not None:
+            sql, params = sql + " WHERE mode = ?", (mode,)
+        for key, data in self.db.execute(sql + " ORDER BY seq", params):
+            yield key, _decode_entry(data)
+
+    def checkpoint(self, source):
+        """Games of source already mined (see mine_puzzles()), 0 if none."""
+        row = self.db.execute("SELECT games FROM mining WHERE source = ?",
+                              (source,)).fetchone()
+        return row[0] if row else 0
+
+    def set_checkpoint(self, source, games):
+        with self.db:
+            self.db.execute("INSERT INTO mining (source, games) VALUES (?, ?)"
+                            " ON CONFLICT (source) DO UPDATE SET games = excluded.games",
+                            (source, games))
+
+
+_puzzle_store = None
+
+
+def open_puzzle_store(path=':memory:'):
+    """Make the store at path the active one, seeding it from GAMES if empty."""
+    global _puzzle_store
+    store = PuzzleStore(path)
+    if not len(store):
+        store.import_games(GAMES)
+    _puzzle_store = store
+    return store
+
+
+def puzzle_store():
+    if _puzzle_store is None:
+        open_puzzle_store()
+    return _puzzle_store
+
+
+def get_game(key):
+    return puzzle_store().get(key)
+
+
 # ---------------------------------------------------------------------------
+# Piece codes
+# A square holds one small integer: colour bit (0 white / 8 black) OR'd with
+# the type code 1..6, and 0 for an empty square.
+# ---------------------------------------------------------------------------
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE, BLACK = 0, 8
+PIECE_TYPES  = ('pawn', 'knight', 'bishop', 'rook', 'queen', 'king')   # type code - 1
+COLOR_BIT    = {'white': WHITE, 'black': BLACK}
+CASTLE_WK, CASTLE_WQ, CASTLE_BK, CASTLE_BQ = 1, 2, 4, 8
+
+
+def piece_code(color, ptype):
+    return COLOR_BIT[color] | (PIECE_TYPES.index(ptype) + 1)
+
+
 class Piece:
-    __slots__ = ('color', 'type', 'has_moved')
+    """Read-only flyweight: one shared instance per piece code (see PIECES)."""
+    __slots__ = ('color', 'type', 'code')
 
     def __init__(self, color, type_):
-        self.color     = color
-        self.type      = type_
-        self.has_moved = False
-
-    def copy(self):
-        p = Piece(self.color, self.type)
-        p.has_moved = self.has_moved
-        return p
+        self.color = color
+        self.type  = type_
+        self.code  = piece_code(color, type_)
 
     def symbol(self):
         return SYMBOLS[self.color][self.type]
 
 
+PIECES = [None] * 16   # code -> Piece (None for empty / unused codes)
+for _color in ('white', 'black'):
+    for _t in PIECE_TYPES:
+        PIECES[piece_code(_color, _t)] = Piece(_color, _t)
+
+
+# ---------------------------------------------------------------------------
+# Board  (64-byte array + castling bitmask)
+# ---------------------------------------------------------------------------
+class _RowView:
+    __slots__ = ('sq', 'base')
+
+    def __init__(self, sq, base):
+        self.sq   = sq
+        self.base = base
+
+    def __getitem__(self, c):
+        return PIECES[self.sq[self.base + c]]
+
+    def __len__(self):
+        return 8
+
+    def __iter__(self):
+        return (PIECES[v] for v in self.sq[self.base:self.base + 8])
+
+
+class Board:
+    """One piece code per square in a bytearray (index r*8 + c, row 0 =
+    rank 8) plus the CASTLE_* rights bitmask.  board[r][c] is a thin
+    read-only view yielding flyweight Pieces (or None) for drawing and UI
+    code; rule code works on board.sq directly."""
+    __slots__ = ('sq', 'castling')
+
+    def __init__(self, sq=None, castling=0):
+        self.sq       = bytearray(sq) if sq is not None else bytearray(64)
+        self.castling = castling
+
+    def __getitem__(self, r):
+        return _RowView(self.sq, r * 8)
+
+    def copy(self):
+        return Board(self.sq, self.castling)
+
+    def track(self, undo):
+        """Called after _make()/_unmake() of undo; a Position updates its
+        bitboards here."""
+
+    def put(self, s, code):
+        self.sq[s] = code
+
+    def pack(self):
+        """65 bytes: the squares plus the castling byte."""
+        return bytes(self.sq) + bytes((self.castling,))
+
+    @classmethod
+    def unpack(cls, data):
+        return cls(data[:64], data[64])
+
+
 # ---------------------------------------------------------------------------
 # Board helpers
 # ---------------------------------------------------------------------------
 def make_board():
-    b = [[None]*8 for _ in range(8)]
+    b = Board(castling=CASTLE_WK | CASTLE_WQ | CASTLE_BK | CASTLE_BQ)
     back = ['rook','knight','bishop','queen','king','bishop','knight','rook']
     for col, t in enumerate(back):
-        b[0][col] = Piece('black', t)
-        b[7][col] = Piece('white', t)
+        b.sq[col]      = piece_code('black', t)
+        b.sq[56 + col] = piece_code('white', t)
     for col in range(8):
-        b[1][col] = Piece('black', 'pawn')
-        b[6][col] = Piece('white', 'pawn')
+        b.sq[8 + col]  = piece_code('black', 'pawn')
+        b.sq[48 + col] = piece_code('white', 'pawn')
     return b
 
 
 def copy_board(board):
-    return [[p.copy() if p else None for p in row] for row in board]
+    return board.copy()
+
+
+def alg_to_rc(sq):
+    """'e5' -> (row, col) in 0=rank8 system."""
+    return 8 - int(sq[1]), ord(sq[0]) - ord('a')
+
 
+def rc_to_alg(r, c):
+    """(row, col) -> 'e5'."""
+    return chr(ord('a') + c) + str(8 - r)
 
+
+_PROMO_LETTER = {'queen': 'q', 'rook': 'r', 'bishop': 'b', 'knight': 'n'}
+
+
+def move_to_uci(frm, to, promotion=None):
+    """((6, 4), (4, 4)) -> 'e2e4'; promotions append the piece letter."""
+    return rc_to_alg(*frm) + rc_to_alg(*to) + (_PROMO_LETTER[promotion] if promotion else '')
+
+
+def uci_to_move(uci):
+    """'e7e8q' -> ((1, 4), (0, 4), 'queen'); inverse of move_to_uci()."""
+    promo = {v: k for k, v in _PROMO_LETTER.items()}.get(uci[4:]) if len(uci) > 4 else None
+    return alg_to_rc(uci[:2]), alg_to_rc(uci[2:4]), promo
+
+
+# ---------------------------------------------------------------------------
+# FEN / EPD
+# read_fen()/write_fen() handle all six FEN fields; read_epd()/write_epd()
+# the four-field EPD form followed by opcodes ("bm Qxf7+; id \"p1\";").
+# iter_epd() streams a pack line by line.
+# ---------------------------------------------------------------------------
 _FEN_MAP = {
     'P':('white','pawn'),  'N':('white','knight'), 'B':('white','bishop'),
     'R':('white','rook'),  'Q':('white','queen'),  'K':('white','king'),
     'p':('black','pawn'),  'n':('black','knight'), 'b':('black','bishop'),
     'r':('black','rook'),  'q':('black','queen'),  'k':('black','king'),
 }
+_FEN_CODE   = {ch: piece_code(*cp) for ch, cp in _FEN_MAP.items()}
+_FEN_LETTER = {code: ch for ch, code in _FEN_CODE.items()}
+
+# (rights bit, FEN letter, king home, rook home) for every castling right
+_CASTLE_HOMES = ((CASTLE_WK, 'K', 60, 63), (CASTLE_WQ, 'Q', 60, 56),
+                 (CASTLE_BK, 'k', 4, 7),   (CASTLE_BQ, 'q', 4, 0))
+
+# EPD opcodes whose operands are strings and are written quoted
+_EPD_STRING_OPS = {'id', 'c0', 'c1', 'c2', 'c3', 'c4', 'c5', 'c6', 'c7', 'c8', 'c9'}
 
 
 def board_from_fen(fen):
-    """Parse FEN board part into 8x8 Piece list (row 0 = rank 8)."""
-    board_part = fen.split()[0]
-    b = [[None]*8 for _ in range(8)]
-    row = col = 0
-    for ch in board_part:
-        if ch == '/':
-            row += 1; col = 0
-        elif ch.isdigit():
-            col += int(ch)
-        else:
-            color, ptype = _FEN_MAP[ch]
-            p = Piece(color, ptype)
-            p.has_moved = True
-            b[row][col] = p
-            col += 1
+    """Parse FEN board part into a Board (row 0 = rank 8), no castling rights."""
+    ranks = fen.split()[0].split('/')
+    if len(ranks) != 8:
+        raise ValueError(f"FEN placement needs 8 ranks: {fen!r}")
+    b = Board()
+    for row, rank in enumerate(ranks):
+        col = 0
+        for ch in rank:
+            if ch in '12345678':
+                col += int(ch)
+            elif ch in _FEN_CODE and col < 8:
+                b.sq[row * 8 + col] = _FEN_CODE[ch]
+                col += 1
+            else:
+                raise ValueError(f"bad FEN placement {rank!r}: {fen!r}")
+        if col != 8:
+            raise ValueError(f"FEN rank {rank!r} does not span 8 files: {fen!r}")
     return b
 
 
-def alg_to_rc(sq):
-    """'e5' -> (row, col) in 0=rank8 system."""
-    return 8 - int(sq[1]), ord(sq[0]) - ord('a')
+def _read_fen_fields(fields, fen):
+    board = board_from_fen(fields[0])
+    for color, ch in (('white', 'K'), ('black', 'k')):
+        if board.sq.count(_FEN_CODE[ch]) != 1:
+            raise ValueError(f"FEN needs exactly one {color} king: {fen!r}")
+    side  = fields[1] if len(fields) > 1 else 'w'
+    if side not in ('w', 'b'):
+        raise ValueError(f"bad FEN side to move {side!r}: {fen!r}")
+    rights = fields[2] if len(fields) > 2 else '-'
+    if rights != '-' and (not rights or set(rights) - set('KQkq')):
+        raise ValueError(f"bad FEN castling field {rights!r}: {fen!r}")
+    # Rights whose king or rook is not at home are dropped
+    for bit, ch, k_sq, r_sq in _CASTLE_HOMES:
+        color = 'white' if ch.isupper() else 'black'
+        if (ch in rights and board.sq[k_sq] == piece_code(color, 'king')
+                and board.sq[r_sq] == piece_code(color, 'rook')):
+            board.castling |= bit
+    ep_field = fields[3] if len(fields) > 3 else '-'
+    if ep_field == '-':
+        ep = None
+    elif (len(ep_field) == 2 and ep_field[0] in 'abcdefgh'
+            and ep_field[1] == ('6' if side == 'w' else '3')):
+        ep = alg_to_rc(ep_field)
+    else:
+        raise ValueError(f"bad FEN en passant square {ep_field!r}: {fen!r}")
+    return board, 'white' if side == 'w' else 'black', ep
+
+
+def read_fen(fen):
+    """Parse all six FEN fields.  Returns (board, turn, ep, halfmove, fullmove);
+    missing trailing fields default to '- 0 1' style values."""
+    fields = fen.split()
+    if not fields or len(fields) > 6:
+        raise ValueError(f"FEN needs 1-6 fields: {fen!r}")
+    board, turn, ep = _read_fen_fields(fields, fen)
+    try:
+        halfmove = int(fields[4]) if len(fields) > 4 else 0
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+    except ValueError:
+        raise ValueError(f"bad FEN move clocks: {fen!r}") from None
+    return board, turn, ep, halfmove, fullmove
+
+
+def parse_fen(fen):
+    """(board, turn, ep) from a FEN; see read_fen() for the clocks."""
+    return read_fen(fen)[:3]
+
+
+def board_to_fen(board):
+    """FEN placement field of a Board."""
+    sq    = board.sq
+    ranks = []
+    for row in range(0, 64, 8):
+        out, empty = [], 0
+        for code in sq[row:row + 8]:
+            if code:
+                if empty:
+                    out.append(str(empty)); empty = 0
+                out.append(_FEN_LETTER[code])
+            else:
+                empty += 1
+        if empty:
+            out.append(str(empty))
+        ranks.append(''.join(out))
+    return '/'.join(ranks)
+
+
+def _fen_head(board, turn, ep):
+    rights = ''.join(ch for bit, ch, _k, _r in _CASTLE_HOMES if board.castling & bit)
+    return ' '.join((board_to_fen(board), 'w' if turn == 'white' else 'b',
+                     rights or '-', rc_to_alg(*ep) if ep else '-'))
+
+
+def write_fen(board, turn, ep=None, halfmove=0, fullmove=1):
+    """Inverse of read_fen()."""
+    return f"{_fen_head(board, turn, ep)} {halfmove} {fullmove}"
+
+
+def _split_epd_ops(text):
+    """'bm Qxf7+; id "a;b";' -> [['bm', 'Qxf7+'], ['id', 'a;b']]"""
+    ops, words, word, quoted, in_word = [], [], [], False, False
+    for ch in text + ';':
+        if quoted:
+            if ch == '"':
+                quoted = False
+            else:
+                word.append(ch)
+        elif ch == '"':
+            quoted = in_word = True
+        elif ch == ';' or ch.isspace():
+            if in_word:
+                words.append(''.join(word)); word = []; in_word = False
+            if ch == ';' and words:
+                ops.append(words); words = []
+        else:
+            word.append(ch); in_word = True
+    if quoted:
+        raise ValueError(f"unterminated string in EPD operations: {text!r}")
+    return ops
+
+
+def read_epd(line):
+    """Parse an EPD record.  Returns (board, turn, ep, ops) where ops maps
+    each opcode to its operand list, e.g. {'bm': ['Qxf7+'], 'id': ['p1']}.
+    A FEN-style record with trailing move clocks is accepted too; the
+    clocks come back as the standard 'hmvc'/'fmvn' opcodes."""
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError(f"EPD needs at least 4 fields: {line!r}")
+    board, turn, ep = _read_fen_fields(fields, line)
+    rest = fields[4] if len(fields) > 4 else ''
+    ops  = {}
+    clocks = rest.split(None, 2)
+    if len(clocks) >= 2 and clocks[0].isdigit() and clocks[1].isdigit():
+        ops['hmvc'], ops['fmvn'] = [clocks[0]], [clocks[1]]
+        rest = clocks[2] if len(clocks) > 2 else ''
+    for words in _split_epd_ops(rest):
+        ops[words[0]] = words[1:]
+    return board, turn, ep, ops
+
+
+def write_epd(board, turn, ep=None, ops=None):
+    """Inverse of read_epd(); opcodes are written in ops' order."""
+    parts = [_fen_head(board, turn, ep)]
+    for opcode, operands in (ops or {}).items():
+        words = [opcode]
+        for arg in operands:
+            if opcode in _EPD_STRING_OPS or not arg or any(
+                    ch.isspace() or ch in ';"' for ch in arg):
+                arg = '"' + arg + '"'
+            words.append(arg)
+        parts.append(' '.join(words) + ';')
+    return ' '.join(parts)
+
+
+def iter_epd(source, strict=True):
+    """Stream EPD records from a path or an iterable of lines, yielding
+    (line_no, board, turn, ep, ops) one at a time so packs of any size run
+    in constant memory.  Blank lines and '#' comments are skipped; with
+    strict=False malformed lines are skipped as well instead of raising."""
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, encoding='utf-8') as f:
+            yield from iter_epd(f, strict)
+        return
+    for line_no, line in enumerate(source, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            record = read_epd(line)
+        except ValueError as e:
+            if strict:
+                raise ValueError(f"line {line_no}: {e}") from None
+            continue
+        yield (line_no,) + record
+
+
+# ---------------------------------------------------------------------------
+# PGN
+# iter_pgn() streams a file one game at a time (only the current game's
+# text is held), skipping variations and NAGs and keeping comments, and
+# decodes SAN against the legal move generator.  pgn_entry() turns a game
+# into a replay entry for the puzzle store / ReplayState.
+# ---------------------------------------------------------------------------
+_PGN_TAG   = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+_PGN_TOKEN = re.compile(r"""
+      \{([^}]*)\}                  # 1: brace comment
+    | ;([^\n]*)                     # 2: rest-of-line comment
+    | (\()                          # 3: variation start
+    | (\))                          # 4: variation end
+    | \$\d+                         #    NAG
+    | (1-0|0-1|1/2-1/2|\*)          # 5: result
+    | \d+\.+                        #    move number
+    | ([^\s{}();$]+)                # 6: SAN
+""", re.X)
+_SAN = re.compile(r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+_SAN_PIECE = {'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN, 'K': KING}
+
+
+def _san_to_sq(board, us, ep_sq, san):
+    """Decode one SAN move into (from, to, promo code) on square indices."""
+    text = san.rstrip('+#!?')
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        ks = 60 if us == WHITE else 4
+        to = ks + (2 if len(text) == 3 else -2)
+        if (ks, to) in _legal_moves(board, us, ep_sq) and board.sq[ks] == us | KING:
+            return ks, to, 0
+        raise ValueError(f"illegal castling {san!r}")
+    m = _SAN.match(text)
+    if not m:
+        raise ValueError(f"unreadable SAN {san!r}")
+    letter, ffile, frank, target, promo = m.groups()
+    ptype = _SAN_PIECE[letter] if letter else PAWN
+    r, c  = alg_to_rc(target)
+    to    = r * 8 + c
+    sq    = board.sq
+    piece = us | ptype
+    # Only pieces of the right type that reach the target are tried, so a
+    # move costs a few pseudo-legal lookups rather than a full generation
+    found = []
+    fr    = sq.find(piece)
+    while fr >= 0:
+        if ((not ffile or fr % 8 == ord(ffile) - 97)
+                and (not frank or fr // 8 == 8 - int(frank))
+                and to in _targets(sq, fr, ep_sq)):
+            undo = _make(board, fr, to, ep_sq)
+            if not _is_attacked(sq, sq.index(us | KING), us ^ 8):
+                found.append(fr)
+            _unmake(board, undo)
+        fr = sq.find(piece, fr + 1)
+    if len(found) != 1:
+        raise ValueError(f"{'ambiguous' if found else 'illegal'} move {san!r}")
+    last_rank = to < 8 or to >= 56
+    if ptype == PAWN and last_rank != bool(promo):
+        raise ValueError(f"bad promotion in {san!r}")
+    return found[0], to, _SAN_PIECE[promo] if promo else 0
+
+
+def san_to_move(board, turn, ep, san):
+    """SAN -> ((r, c), (mr, mc), promotion type or None) for turn on board."""
+    fr, to, promo = _san_to_sq(board, COLOR_BIT[turn], _ep_sq(ep), san)
+    return _RC[fr], _RC[to], PIECE_TYPES[promo - 1] if promo else None
+
+
+def _pgn_game(tag_lines, move_lines):
+    """Decode one game's text.  Returns (tags, moves, sans, notes): moves are
+    (from, to[, promotion]) algebraic pairs as replay entries store them,
+    notes holds the comment after each ply ('' for none)."""
+    tags = {}
+    for line in tag_lines:
+        for name, value in _PGN_TAG.findall(line):
+            tags[name] = value.replace('\\"', '"').replace('\\\\', '\\')
+    if 'FEN' in tags:
+        board, turn, ep = parse_fen(tags['FEN'])
+    else:
+        board, turn, ep = make_board(), 'white', None
+    us, ep_sq = COLOR_BIT[turn], _ep_sq(ep)
+    moves, sans, notes = [], [], []
+    depth = 0
+    for m in _PGN_TOKEN.finditer('\n'.join(move_lines)):
+        comment, line_comment, open_var, close_var, _result, san = m.groups()
+        if open_var:
+            depth += 1
+        elif close_var:
+            depth -= 1
+        elif depth:
+            continue
+        elif comment is not None or line_comment is not None:
+            if notes:
+                text = ' '.join((comment if comment is not None else line_comment).split())
+                notes[-1] = (notes[-1] + ' ' + text).strip()
+        elif san:
+            fr, to, promo = _san_to_sq(board, us, ep_sq, san)
+            new_ep = (fr + to) // 2 if board.sq[fr] & 7 == PAWN and abs(to - fr) == 16 else -1
+            _make(board, fr, to, ep_sq, promo)
+            mv = (rc_to_alg(*_RC[fr]), rc_to_alg(*_RC[to]))
+            moves.append(mv + (PIECE_TYPES[promo - 1],) if promo else mv)
+            sans.append(san)
+            notes.append('')
+            us, ep_sq = us ^ 8, new_ep
+    return tags, moves, sans, notes
+
+
+def iter_pgn(source, strict=True):
+    """Stream games from a path or an iterable of lines, yielding
+    (game_no, tags, moves, sans, notes) per game; see _pgn_game().  With
+    strict=False games that fail to decode are skipped instead of raising."""
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, encoding='utf-8', errors='replace') as f:
+            yield from iter_pgn(f, strict)
+        return
+    tag_lines, move_lines = [], []
+    in_comment = False
+    game_no    = 0
+
+    def finish():
+        try:
+            return (game_no,) + _pgn_game(tag_lines, move_lines)
+        except ValueError as e:
+            if strict:
+                raise ValueError(f"game {game_no}: {e}") from None
+            return None
+
+    for line in source:
+        text = line.strip()
+        if not in_comment:
+            if not text or text.startswith('%'):
+                continue
+            if text.startswith('['):
+                if move_lines:
+                    game = finish()
+                    if game:
+                        yield game
+                    tag_lines, move_lines = [], []
+                if not tag_lines:
+                    game_no += 1
+                tag_lines.append(text)
+                continue
+            if not tag_lines and not move_lines:
+                game_no += 1
+        move_lines.append(text)
+        # A '{' comment may run over several lines and contain '[' lines
+        for ch in text:
+            if ch == '{':
+                in_comment = True
+            elif ch == '}':
+                in_comment = False
+            elif ch == ';' and not in_comment:
+                break
+    if move_lines or tag_lines:
+        game = finish()
+        if game:
+            yield game
+
+
+def pgn_entry(tags, moves, sans, notes):
+    """Replay entry (the GAMES 'replay' shape) for one decoded PGN game."""
+    if 'FEN' in tags:
+        _b, turn, _ep, _hm, fullmove = read_fen(tags['FEN'])
+        ply = (fullmove - 1) * 2 + (turn == 'black')
+    else:
+        ply = 0
+    explanations = []
+    for san, note in zip(sans, notes):
+        num = f"{ply // 2 + 1}." if ply % 2 == 0 else f"{ply // 2 + 1}..."
+        explanations.append(f"{num} {san}" + (f" — {note}" if note else ''))
+        ply += 1
+    entry = {
+        'label':        f"{tags.get('White', '?')} - {tags.get('Black', '?')}",
+        'mode':         'replay',
+        'subtitle':     ', '.join(tags[t] for t in ('Event', 'Date', 'Result')
+                                  if tags.get(t, '?') not in ('?', '')),
+        'moves':        moves,
+        'explanations': explanations,
+    }
+    if 'FEN' in tags:
+        entry['fen'] = tags['FEN']
+    return entry
+
+
+def iter_pgn_entries(source, strict=True):
+    """(key, replay entry) per game, ready for PuzzleStore.add_many()."""
+    name = os.path.basename(source) if isinstance(source, str) else 'pgn'
+    for game_no, tags, moves, sans, notes in iter_pgn(source, strict):
+        yield f"{name}#{game_no}", pgn_entry(tags, moves, sans, notes)
+
+
+def bench_pgn(path):
+    """Decode every game in path.  Returns (games, plies, seconds)."""
+    games = plies = 0
+    t0 = time.perf_counter()
+    for _n, _tags, moves, _sans, _notes in iter_pgn(path, strict=False):
+        games += 1
+        plies += len(moves)
+    return games, plies, time.perf_counter() - t0
+
+
+def bench_pgn_main(args):
+    games, plies, secs = bench_pgn(args.bench_pgn)
+    secs = secs or 1e-9
+    print(f"{games} games, {plies} plies in {secs:.2f}s: "
+          f"{games / secs:,.0f} games/s, {plies / secs:,.0f} plies/s")
+    return 0
 
 
 # ---------------------------------------------------------------------------
 # GameState  (Play Chess mode)
 # ---------------------------------------------------------------------------
 class GameState:
-    def __init__(self):
+    def __init__(self, engine_colors=(), engine_depth=None, engine_movetime=None):
+        # Colours the engine plays and its limits survive reset()
+        self.engine_colors   = set(engine_colors)
+        self.engine_depth    = engine_depth
+        self.engine_movetime = engine_movetime
         self.reset()
 
     def reset(self):
@@ -303,6 +966,12 @@ class GameState:
         self.promotion_pending = None
         self.promotion_color   = None
         self.last_move         = None
+        self.zobrist           = zobrist_key(self.board, self.turn, None)
+        self.move_map          = position_status(self.board, self.turn, None, self.zobrist)[1]
+        self.engine_info       = ''
+        self.engine_job        = None   # EngineWorker job id while thinking
+        self.engine_stop_at    = None   # perf_counter() deadline for engine_job
+        self.ponder            = None   # (job id, predicted move, start time)
 
 
 # ---------------------------------------------------------------------------
@@ -314,20 +983,21 @@ class PuzzleState:
         self._load()
 
     def _load(self):
-        gm = GAMES[self.game_key]
-        self.board             = board_from_fen(gm['fen'])
-        self.turn              = 'white' if ' w ' in gm['fen'] else 'black'
-        self.en_passant_target = None
+        gm = get_game(self.game_key)
+        self.board, self.turn, self.en_passant_target = parse_fen(gm['fen'])
         self.selected          = None
         self.valid_moves       = []
         self.status            = 'playing'   # playing|check|wrong|solved|stalemate
+        self.zobrist           = zobrist_key(self.board, self.turn, self.en_passant_target)
+        self.move_map          = position_status(self.board, self.turn, self.en_passant_target,
+                                                 self.zobrist)[1]
         self.move_step         = 0
-        self.hint_timer        = 0
-        self.flash_timer       = 0
-        self.correct_timer     = 0
+        self.hint_until        = None   # perf_counter() deadlines, None when off
+        self.flash_until       = None
+        self.correct_until     = None
         self.show_nav_popup    = False
         self.nav_pending_key   = None
-        self.nav_popup_timer   = 0
+        self.nav_popup_until   = None
 
     def reset(self):
         self._load()
@@ -338,96 +1008,132 @@ class PuzzleState:
 
     @property
     def puzzle(self):
-        return GAMES[self.game_key]
+        return get_game(self.game_key)
 
 
 # ---------------------------------------------------------------------------
 # ReplayState  (Alekhine's Defense / replay mode)
 # ---------------------------------------------------------------------------
-def _build_replay_boards(game_key):
-    """Pre-compute list of boards for every step (0=start, 1=after move1, ...)."""
-    gm     = GAMES[game_key]
-    board  = make_board()
-    turn   = 'white'
-    ep     = None
-    boards = [copy_board(board)]
-    last_moves = [None]   # last_move before each step
+REPLAY_CHECKPOINT = 16   # plies between packed board snapshots
+REPLAY_CACHE_SIZE = 8    # recently viewed boards kept decoded
+
+
+def _build_replay(game_key):
+    """Encode a replay entry compactly.  Returns (snapshots, deltas, keys):
+    snapshots holds Board.pack() of every REPLAY_CHECKPOINT-th step, deltas
+    four bytes per ply (from, to, promotion code, ep square before the move
+    + 1), keys the Zobrist key of every step (0=start, 1=after move1, ...)."""
+    gm     = get_game(game_key)
+    if 'fen' in gm:
+        board, turn, ep = parse_fen(gm['fen'])
+    else:
+        board, turn, ep = make_board(), 'white', None
+    ep_sq     = _ep_sq(ep)
+    snapshots = [board.pack()]
+    deltas    = bytearray()
+    keys      = [zobrist_key(board, turn, ep)]
 
-    for fr, to in gm['moves']:
+    for fr, to, *promo in gm['moves']:
         r,  c  = alg_to_rc(fr)
         mr, mc = alg_to_rc(to)
-        piece  = board[r][c]
-        new_ep = None
-
-        # En passant capture
-        if piece.type == 'pawn' and ep and (mr, mc) == ep:
-            board[r][mc] = None
-
-        # Castling rook move
-        if piece.type == 'king' and abs(mc - c) == 2:
-            back = r
-            if mc == 6:
-                board[back][5] = board[back][7]; board[back][7] = None
-                if board[back][5]: board[back][5].has_moved = True
-            elif mc == 2:
-                board[back][3] = board[back][0]; board[back][0] = None
-                if board[back][3]: board[back][3].has_moved = True
+        fr, to = r * 8 + c, mr * 8 + mc
+        code   = PIECE_TYPES.index(promo[0]) + 1 if promo else 0
 
         # Pawn double push en passant target
-        if piece.type == 'pawn' and abs(mr - r) == 2:
-            new_ep = ((r + mr) // 2, c)
+        new_ep = (fr + to) // 2 if board.sq[fr] & 7 == PAWN and abs(to - fr) == 16 else -1
 
-        board[mr][mc]   = piece
-        board[r][c]     = None
-        piece.has_moved = True
-        ep   = new_ep
-        turn = 'black' if turn == 'white' else 'white'
+        undo   = _make(board, fr, to, ep_sq, code)
+        keys.append(zobrist_step(keys[-1], undo, _RC[ep_sq] if ep_sq >= 0 else None,
+                                 _RC[new_ep] if new_ep >= 0 else None, board.castling))
+        deltas += bytes((fr, to, code, ep_sq + 1))
+        ep_sq   = new_ep
+        if len(keys) % REPLAY_CHECKPOINT == 1:
+            snapshots.append(board.pack())
 
-        boards.append(copy_board(board))
-        last_moves.append(((r, c), (mr, mc)))
-
-    return boards, last_moves
+    return snapshots, deltas, keys
 
 
 class ReplayState:
     def __init__(self, game_key='game3'):
         self.game_key        = game_key
         self.step            = 0        # 0 = starting position
-        self.boards, self.last_moves = _build_replay_boards(game_key)
-        self.total_steps     = len(self.boards) - 1   # 24
+        self._load_moves()
         self.show_nav_popup  = False
         self.nav_pending_key = None
-        self.nav_popup_timer = 0
+        self.nav_popup_until = None
+
+    def _load_moves(self):
+        self.snapshots, self.deltas, self.keys = _build_replay(self.game_key)
+        self.total_steps = len(self.deltas) // 4
+        self._boards     = OrderedDict()   # step -> Board, LRU
 
     def reset(self):
         self.step            = 0
         self.show_nav_popup  = False
         self.nav_pending_key = None
-        self.nav_popup_timer = 0
+        self.nav_popup_until = None
 
     def switch_game(self, game_key):
         self.game_key        = game_key
         self.step            = 0
         self.show_nav_popup  = False
         self.nav_pending_key = None
-        self.nav_popup_timer = 0
-        if GAMES[game_key]['mode'] == 'replay':
-            self.boards, self.last_moves = _build_replay_boards(game_key)
-            self.total_steps = len(self.boards) - 1
+        self.nav_popup_until = None
+        if get_game(game_key)['mode'] == 'replay':
+            self._load_moves()
+
+    def board_at(self, step):
+        """Board after step plies: the nearest checkpoint at or before step,
+        or the previous step when it is cached, replayed forward."""
+        boards = self._boards
+        board  = boards.get(step)
+        if board is not None:
+            boards.move_to_end(step)
+            return board
+        prev = boards.get(step - 1)
+        if prev is not None and step % REPLAY_CHECKPOINT:
+            board, start = prev.copy(), step - 1
+        else:
+            start = step - step % REPLAY_CHECKPOINT
+            board = Board.unpack(self.snapshots[start // REPLAY_CHECKPOINT])
+        d = self.deltas
+        for i in range(start * 4, step * 4, 4):
+            _make(board, d[i], d[i + 1], d[i + 3] - 1, d[i + 2])
+        boards[step] = board
+        if len(boards) > REPLAY_CACHE_SIZE:
+            boards.popitem(last=False)
+        return board
 
     @property
     def board(self):
-        return self.boards[self.step]
+        return self.board_at(self.step)
 
     @property
     def last_move(self):
-        return self.last_moves[self.step]
+        if self.step == 0:
+            return None
+        i = (self.step - 1) * 4
+        return _RC[self.deltas[i]], _RC[self.deltas[i + 1]]
+
+    @property
+    def zobrist(self):
+        return self.keys[self.step]
+
+    @property
+    def ply(self):
+        """Plies played before the current step, counting from move 1 even
+        when the game starts from a FEN."""
+        gm = get_game(self.game_key)
+        if 'fen' not in gm:
+            return self.step
+        _b, turn, _ep, _hm, fullmove = read_fen(gm['fen'])
+        return (fullmove - 1) * 2 + (turn == 'black') + self.step
 
     @property
     def explanation(self):
         if self.step == 0:
-            return GAMES[self.game_key].get('subtitle', '')
-        return GAMES[self.game_key]['explanations'][self.step - 1]
+            return get_game(self.game_key).get('subtitle', '')
+        return get_game(self.game_key)['explanations'][self.step - 1]
 
     @property
     def is_finished(self):
@@ -445,204 +1151,2330 @@ def opponent(color):
     return 'black' if color == 'white' else 'white'
 
 
+# (row, col) for every square index; shared tuples, so converting costs nothing
+_RC = tuple(divmod(s, 8) for s in range(64))
+
+
+def _ep_sq(ep):
+    return ep[0] * 8 + ep[1] if ep else -1
+
+
 def find_king(board, color):
+    code = COLOR_BIT[color] | KING
+    if code in board.sq:
+        return _RC[board.sq.index(code)]
+    return None
+
+
+# Precomputed move tables, indexed by square r*8 + c.  Entries are square
+# indices already clipped to the board, so generators never bounds-check.
+_KNIGHT_STEPS = ((-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1))
+_KING_STEPS   = ((-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1))
+_ORTHO_DIRS   = ((-1,0),(1,0),(0,-1),(0,1))
+_DIAG_DIRS    = ((-1,-1),(-1,1),(1,-1),(1,1))
+
+
+def _step_table(steps):
+    return [tuple((r + dr) * 8 + c + dc for dr, dc in steps if in_bounds(r + dr, c + dc))
+            for r in range(8) for c in range(8)]
+
+
+def _ray_table(dirs):
+    """Per square: one tuple of squares per direction, nearest first
+    (empty rays dropped)."""
+    table = []
     for r in range(8):
         for c in range(8):
-            p = board[r][c]
-            if p and p.color == color and p.type == 'king':
-                return r, c
-    return None
+            rays = []
+            for dr, dc in dirs:
+                ray = []
+                nr, nc = r + dr, c + dc
+                while in_bounds(nr, nc):
+                    ray.append(nr * 8 + nc)
+                    nr += dr; nc += dc
+                if ray:
+                    rays.append(tuple(ray))
+            table.append(tuple(rays))
+    return table
+
+
+KNIGHT_TARGETS = _step_table(_KNIGHT_STEPS)
+KING_TARGETS   = _step_table(_KING_STEPS)
+ORTHO_RAYS     = _ray_table(_ORTHO_DIRS)
+DIAG_RAYS      = _ray_table(_DIAG_DIRS)
+QUEEN_RAYS     = [o + d for o, d in zip(ORTHO_RAYS, DIAG_RAYS)]
+# Pawn tables keyed by colour bit: PAWN_PUSHES[bit][sq] = (one-step, two-step), -1 = none
+PAWN_PUSHES    = {
+    bit: [((r + d) * 8 + c if in_bounds(r + d, c) else -1,
+           (r + 2 * d) * 8 + c if r == start else -1)
+          for r in range(8) for c in range(8)]
+    for bit, d, start in ((WHITE, -1, 6), (BLACK, 1, 1))
+}
+PAWN_CAPTURES  = {
+    WHITE: _step_table(((-1, -1), (-1, 1))),
+    BLACK: _step_table(((1, -1), (1, 1))),
+}
+_STEP_TARGETS = {KNIGHT: KNIGHT_TARGETS, KING: KING_TARGETS}
+_SLIDER_RAYS  = {BISHOP: DIAG_RAYS, ROOK: ORTHO_RAYS, QUEEN: QUEEN_RAYS}
+
+
+def _targets(sq, s, ep_sq):
+    """Pseudo-legal target squares for the piece on square s of sq."""
+    code  = sq[s]
+    own   = code & 8
+    t     = code & 7
+    moves = []
+    if t == PAWN:
+        one, two = PAWN_PUSHES[own][s]
+        if one >= 0 and not sq[one]:
+            moves.append(one)
+            if two >= 0 and not sq[two]:
+                moves.append(two)
+        for x in PAWN_CAPTURES[own][s]:
+            v = sq[x]
+            if (v and v & 8 != own) or x == ep_sq:
+                moves.append(x)
+    elif t in _SLIDER_RAYS:
+        for ray in _SLIDER_RAYS[t][s]:
+            for x in ray:
+                v = sq[x]
+                if not v:
+                    moves.append(x)
+                else:
+                    if v & 8 != own:
+                        moves.append(x)
+                    break
+    else:
+        for x in _STEP_TARGETS[t][s]:
+            v = sq[x]
+            if not v or v & 8 != own:
+                moves.append(x)
+    return moves
 
 
 def raw_moves(board, r, c, ep):
-    piece = board[r][c]
+    if not board.sq[r * 8 + c]:
+        return []
+    return [_RC[x] for x in _targets(board.sq, r * 8 + c, _ep_sq(ep))]
+
+
+def _is_attacked(sq, s, by):
+    """True if colour bit by attacks square s -- looks outward from s:
+    pawn/knight/king offsets, then one walk per ray."""
+    # by's pawns attack s from the squares an opposing pawn would capture to
+    code = by | PAWN
+    for x in PAWN_CAPTURES[by ^ 8][s]:
+        if sq[x] == code:
+            return True
+    code = by | KNIGHT
+    for x in KNIGHT_TARGETS[s]:
+        if sq[x] == code:
+            return True
+    code = by | KING
+    for x in KING_TARGETS[s]:
+        if sq[x] == code:
+            return True
+    queen = by | QUEEN
+    for rays, slider in ((ORTHO_RAYS[s], by | ROOK), (DIAG_RAYS[s], by | BISHOP)):
+        for ray in rays:
+            for x in ray:
+                v = sq[x]
+                if v:
+                    if v == slider or v == queen:
+                        return True
+                    break
+    return False
+
+
+def _attacker_squares(sq, s, by):
+    """Every square of a colour-bit-by piece attacking square s."""
+    found = [x for x in PAWN_CAPTURES[by ^ 8][s] if sq[x] == by | PAWN]
+    found += [x for x in KNIGHT_TARGETS[s] if sq[x] == by | KNIGHT]
+    found += [x for x in KING_TARGETS[s] if sq[x] == by | KING]
+    queen = by | QUEEN
+    for rays, slider in ((ORTHO_RAYS[s], by | ROOK), (DIAG_RAYS[s], by | BISHOP)):
+        for ray in rays:
+            for x in ray:
+                v = sq[x]
+                if v:
+                    if v == slider or v == queen:
+                        found.append(x)
+                    break
+    return found
+
+
+def attackers(board, r, c, by_color):
+    """List of (row, col) squares holding by_color pieces that attack (r, c)."""
+    return [_RC[x] for x in _attacker_squares(board.sq, r * 8 + c, COLOR_BIT[by_color])]
+
+
+def sq_attacked(board, r, c, by_color):
+    return _is_attacked(board.sq, r * 8 + c, COLOR_BIT[by_color])
+
+
+def checkers(board, color):
+    """Squares of the pieces giving check to color's king."""
+    kr, kc = find_king(board, color)
+    return attackers(board, kr, kc, opponent(color))
+
+
+def is_in_check(board, color):
+    us = COLOR_BIT[color]
+    return _is_attacked(board.sq, board.sq.index(us | KING), us ^ 8)
+
+
+# Castling rights that survive a move touching each square (king/rook homes)
+_CASTLE_KEEP = [15] * 64
+_CASTLE_KEEP[60] &= ~(CASTLE_WK | CASTLE_WQ)   # e1
+_CASTLE_KEEP[63] &= ~CASTLE_WK                 # h1
+_CASTLE_KEEP[56] &= ~CASTLE_WQ                 # a1
+_CASTLE_KEEP[4]  &= ~(CASTLE_BK | CASTLE_BQ)   # e8
+_CASTLE_KEEP[7]  &= ~CASTLE_BK                 # h8
+_CASTLE_KEEP[0]  &= ~CASTLE_BQ                 # a8
+
+
+def _make(board, fr, to, ep_sq=-1, promo=0):
+    """make_move() on square indices; promo is a type code (0 = none)."""
+    sq       = board.sq
+    piece    = sq[fr]
+    captured = sq[to]
+    cap_sq   = to
+    rf = rt  = -1
+    t        = piece & 7
+    if t == PAWN:
+        if to == ep_sq:
+            cap_sq   = to + 8 if piece & 8 == WHITE else to - 8
+            captured = sq[cap_sq]
+            sq[cap_sq] = 0
+    elif t == KING and (to - fr == 2 or fr - to == 2):
+        rf, rt = (fr + 3, fr + 1) if to > fr else (fr - 4, fr - 1)
+        sq[rt] = sq[rf]; sq[rf] = 0
+    placed = (piece & 8) | promo if promo and t == PAWN and (to < 8 or to >= 56) else piece
+    sq[to] = placed
+    sq[fr] = 0
+    castling = board.castling
+    board.castling = castling & _CASTLE_KEEP[fr] & _CASTLE_KEEP[to]
+    return (fr, to, piece, placed, captured, cap_sq, rf, rt, castling)
+
+
+def _unmake(board, undo):
+    fr, to, piece, _placed, captured, cap_sq, rf, rt, castling = undo
+    sq = board.sq
+    sq[fr] = piece
+    sq[to] = 0
+    if captured:
+        sq[cap_sq] = captured
+    if rf >= 0:
+        sq[rf] = sq[rt]; sq[rt] = 0
+    board.castling = castling
+
+
+def make_move(board, move, ep=None, promotion=None):
+    """Play move ((r, c), (mr, mc)) on board in place and return an undo record
+    for unmake_move().  ep is the en passant target before the move; a pawn
+    reaching the last rank becomes promotion (None leaves it a pawn, which is
+    how Play mode waits for the promotion popup)."""
+    (r, c), (mr, mc) = move
+    promo = PIECE_TYPES.index(promotion) + 1 if promotion else 0
+    undo  = _make(board, r * 8 + c, mr * 8 + mc, _ep_sq(ep), promo)
+    board.track(undo)
+    return undo
+
+
+def unmake_move(board, undo):
+    """Take back a move played with make_move()."""
+    _unmake(board, undo)
+    board.track(undo)
+
+
+def legal_moves(board, r, c, ep):
+    if isinstance(board, Position):
+        return [_RC[to] for _fr, to, promo in board.legal_moves_from(r * 8 + c, _ep_sq(ep))
+                if promo in (0, QUEEN)]   # one entry per promotion square
+    sq    = board.sq
+    s     = r * 8 + c
+    code  = sq[s]
+    if not code:
+        return []
+    us     = code & 8
+    ep_sq  = _ep_sq(ep)
+    result = []
+    for x in _targets(sq, s, ep_sq):
+        undo = _make(board, s, x, ep_sq)
+        if not _is_attacked(sq, sq.index(us | KING), us ^ 8):
+            result.append(_RC[x])
+        _unmake(board, undo)
+    if code & 7 == KING:
+        result.extend(_RC[x] for x in _castle_targets(board, us, s))
+    return result
+
+
+def _castle_targets(board, us, ks):
+    """Castling destinations for the colour-bit-us king on ks: right still
+    held, squares between empty, king not in check and not crossing or
+    landing on an attacked square."""
+    sq   = board.sq
+    them = us ^ 8
+    result = []
+    for bit, _ch, k_sq, r_sq in _CASTLE_HOMES:
+        if not board.castling & bit or k_sq != ks or sq[r_sq] != us | ROOK:
+            continue
+        step = 1 if r_sq > k_sq else -1
+        if any(sq[x] for x in range(k_sq + step, r_sq, step)):
+            continue
+        if not (_is_attacked(sq, k_sq, them) or _is_attacked(sq, k_sq + step, them)
+                or _is_attacked(sq, k_sq + 2 * step, them)):
+            result.append(k_sq + 2 * step)
+    return result
+
+
+def all_legal_moves(board, color, ep):
+    if isinstance(board, Position):
+        return [(_RC[fr], _RC[to]) for fr, to, promo
+                in board.legal_moves(COLOR_BIT[color], _ep_sq(ep)) if promo in (0, QUEEN)]
+    return generate_legal_moves(board, color, ep)
+
+
+def _pins_and_checks(sq, us, ks):
+    """One sweep of the eight rays around the colour-bit-us king on ks.
+    Returns (pinned, checkers): pinned maps a pinned piece's square to the
+    squares it may still move to (the line up to and including the pinner)."""
+    them     = us ^ 8
+    pinned   = {}
+    checkers = []
+    queen    = them | QUEEN
+    for rays, slider in ((ORTHO_RAYS[ks], them | ROOK), (DIAG_RAYS[ks], them | BISHOP)):
+        for ray in rays:
+            own = -1
+            for i, x in enumerate(ray):
+                v = sq[x]
+                if v:
+                    if v & 8 == us:
+                        if own >= 0:
+                            break
+                        own = x
+                    else:
+                        if v == slider or v == queen:
+                            if own >= 0:
+                                pinned[own] = ray[:i + 1]
+                            else:
+                                checkers.append(x)
+                        break
+    # Leaper and pawn checks
+    checkers += [x for x in PAWN_CAPTURES[us][ks] if sq[x] == them | PAWN]
+    checkers += [x for x in KNIGHT_TARGETS[ks] if sq[x] == them | KNIGHT]
+    return pinned, checkers
+
+
+def _between(a, b):
+    """Squares strictly between two squares on a shared line."""
+    (ar, ac), (br, bc) = _RC[a], _RC[b]
+    step = ((br > ar) - (br < ar)) * 8 + ((bc > ac) - (bc < ac))
+    return range(a + step, b, step)
+
+
+def _legal_moves(board, us, ep_sq):
+    """generate_legal_moves() on square indices: [(from, to), ...]."""
+    sq   = board.sq
+    them = us ^ 8
+    king = us | KING
+    ks   = sq.index(king)
+    pinned, chk = _pins_and_checks(sq, us, ks)
+    moves = []
+
+    # King steps, tested with the king lifted off the board
+    sq[ks] = 0
+    for x in KING_TARGETS[ks]:
+        v = sq[x]
+        if (not v or v & 8 == them) and not _is_attacked(sq, x, them):
+            moves.append((ks, x))
+    sq[ks] = king
+    if len(chk) > 1:
+        return moves
+    if not chk and board.castling:
+        moves += [(ks, x) for x in _castle_targets(board, us, ks)]
+
+    # Evasion mask: capture the checker or block its line
+    mask = None
+    if chk:
+        c0   = chk[0]
+        mask = {c0}
+        if sq[c0] & 7 in _SLIDER_RAYS:
+            mask.update(_between(ks, c0))
+
+    for s, v in enumerate(sq):
+        if not v or v & 8 != us or v == king:
+            continue
+        line = pinned.get(s)
+        for x in _targets(sq, s, ep_sq):
+            if line is not None and x not in line:
+                continue
+            if x == ep_sq and v & 7 == PAWN:
+                undo = _make(board, s, x, ep_sq)
+                ok   = not _is_attacked(sq, ks, them)
+                _unmake(board, undo)
+                if ok:
+                    moves.append((s, x))
+                continue
+            if mask is not None and x not in mask:
+                continue
+            moves.append((s, x))
+    return moves
+
+
+def generate_legal_moves(board, color, ep):
+    """All legal ((r, c), (mr, mc)) moves for color without make-and-test.
+
+    Pins, checkers and the check-evasion mask are computed once; in double
+    check only the king moves.  The king's own steps are tested with the
+    king lifted off the board so it cannot hide behind itself, and the rare
+    en passant capture is still verified by make/unmake (it removes two
+    pawns from a rank and can uncover a check no pin test sees)."""
+    return [(_RC[f], _RC[t]) for f, t in _legal_moves(board, COLOR_BIT[color], _ep_sq(ep))]
+
+
+def apply_move(gs, r, c, mr, mc):
+    """Apply a fully-legal move to a GameState, handling all side-effects."""
+    board  = gs.board
+    piece  = board[r][c]
+    opp    = opponent(piece.color)
+    new_ep = None
+
+    if piece.type == 'pawn' and abs(mr - r) == 2:
+        new_ep = ((r + mr) // 2, c)
+
+    undo   = make_move(board, ((r, c), (mr, mc)), gs.en_passant_target)
+
+    promote_row = 0 if piece.color == 'white' else 7
+    promoting   = piece.type == 'pawn' and mr == promote_row
+    gs.zobrist  = zobrist_step(gs.zobrist, undo, gs.en_passant_target, new_ep,
+                               board.castling, switch_side=not promoting)
+    if promoting:
+        gs.promotion_pending = (mr, mc)
+        gs.promotion_color   = piece.color
+        gs.move_map          = {}
+        gs.en_passant_target = new_ep
+        gs.last_move = ((r, c), (mr, mc))
+        return
+
+    gs.en_passant_target = new_ep
+    gs.last_move = ((r, c), (mr, mc))
+    gs.turn = opp
+    _update_status(gs)
+
+
+def promote_piece(board, r, c, ptype):
+    """Turn the pawn waiting on (r, c) into ptype."""
+    board.put(r * 8 + c, (board.sq[r * 8 + c] & 8) | (PIECE_TYPES.index(ptype) + 1))
+
+
+def legal_move_map(board, color, ep):
+    """{from_sq: [target, ...]} for every piece of color with a legal move."""
+    move_map = {}
+    for frm, to in all_legal_moves(board, color, ep):
+        move_map.setdefault(frm, []).append(to)
+    return move_map
+
+
+# ---------------------------------------------------------------------------
+# Status cache
+# position_status() results by Zobrist key, so a position seen before (a
+# puzzle retried after a wrong move, a move taken back and replayed) costs
+# one dict lookup instead of a move generation.  Play and Puzzle modes
+# share the one STATUS_CACHE; move maps handed out are shared, read-only.
+# ---------------------------------------------------------------------------
+STATUS_CACHE_SIZE = 4096
+
+
+class StatusCache:
+    """Bounded LRU of Zobrist key -> (status, move map), with hit/miss counts."""
+    __slots__ = ('size', 'hits', 'misses', '_entries')
+
+    def __init__(self, size=STATUS_CACHE_SIZE):
+        self.size     = size
+        self.hits     = 0
+        self.misses   = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        hit = self._entries.get(key)
+        if hit is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return hit
+
+    def put(self, key, value):
+        self._entries[key] = value
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        looked = self.hits + self.misses
+        return {'entries': len(self._entries), 'size': self.size, 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': self.hits / looked if looked else 0.0}
+
+
+STATUS_CACHE = StatusCache()
+
+
+def position_status(board, color, ep, key=None):
+    """('checkmate'|'stalemate'|'check'|'playing', legal move map) for color
+    to move -- one move generation serves status and click handling.  key
+    is the position's Zobrist key if the caller keeps one; results come
+    from STATUS_CACHE when it has them."""
+    if key is None:
+        key = zobrist_key(board, color, ep)
+    hit = STATUS_CACHE.get(key)
+    if hit is not None:
+        return hit
+    move_map = legal_move_map(board, color, ep)
+    chk      = is_in_check(board, color)
+    if not move_map:
+        status = 'checkmate' if chk else 'stalemate'
+    else:
+        status = 'check' if chk else 'playing'
+    STATUS_CACHE.put(key, (status, move_map))
+    return status, move_map
+
+
+def _update_status(gs):
+    gs.status, gs.move_map = position_status(gs.board, gs.turn, gs.en_passant_target,
+                                             gs.zobrist)
+
+
+# ---------------------------------------------------------------------------
+# Bitboard position  (alternative core for bulk rule queries)
+# Square index = r*8 + c, so bit 0 is a8 and bit 63 is h1 -- the same
+# square numbering Board uses.
+# ---------------------------------------------------------------------------
+_BB_CODE  = [color | t for color in (WHITE, BLACK) for t in range(PAWN, KING + 1)]   # bb index -> code
+_CODE_BB  = [_BB_CODE.index(c) if c in _BB_CODE else None for c in range(16)]   # code -> bb index
+
+
+def _leaper_table(offsets):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for dr, dc in offsets:
+            if in_bounds(r + dr, c + dc):
+                bb |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(bb)
+    return table
+
+
+_BB_KNIGHT = _leaper_table([(-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)])
+_BB_KING   = _leaper_table([(-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)])
+_BB_PAWN_ATTACKS = {
+    'white': _leaper_table([(-1,-1),(-1,1)]),
+    'black': _leaper_table([(1,-1),(1,1)]),
+}
+
+# Sliding attacks: for every square and line (rank, file, diagonal,
+# anti-diagonal) a dict maps the relevant blocker subset straight to the
+# attack set.  Same idea as magic bitboards, with the dict hash standing in
+# for the magic multiply (64-bit overflow arithmetic is slow in Python).
+_LINE_DIRS = (((0, 1), (0, -1)), ((1, 0), (-1, 0)),
+              ((1, 1), (-1, -1)), ((1, -1), (-1, 1)))
+
+
+def _ray_attacks(r, c, dirs, occ):
+    bb = 0
+    for dr, dc in dirs:
+        nr, nc = r + dr, c + dc
+        while in_bounds(nr, nc):
+            bit = 1 << (nr * 8 + nc)
+            bb |= bit
+            if occ & bit:
+                break
+            nr += dr; nc += dc
+    return bb
+
+
+def _build_line_tables():
+    masks   = [[0] * 64 for _ in _LINE_DIRS]
+    attacks = [[None] * 64 for _ in _LINE_DIRS]
+    for line, dirs in enumerate(_LINE_DIRS):
+        for sq in range(64):
+            r, c = divmod(sq, 8)
+            mask = 0
+            for dr, dc in dirs:
+                nr, nc = r + dr, c + dc
+                while in_bounds(nr + dr, nc + dc):   # edge squares never block
+                    mask |= 1 << (nr * 8 + nc)
+                    nr += dr; nc += dc
+            table = {}
+            sub = 0
+            while True:   # every subset of mask (carry-rippler)
+                table[sub] = _ray_attacks(r, c, dirs, sub)
+                sub = (sub - mask) & mask
+                if sub == 0:
+                    break
+            masks[line][sq]   = mask
+            attacks[line][sq] = table
+    return masks, attacks
+
+
+(_RANK_MASK, _FILE_MASK, _DIAG_MASK, _ANTI_MASK), \
+    (_RANK_ATT, _FILE_ATT, _DIAG_ATT, _ANTI_ATT) = _build_line_tables()
+
+
+def _rook_attacks(sq, occ):
+    return (_RANK_ATT[sq][occ & _RANK_MASK[sq]] |
+            _FILE_ATT[sq][occ & _FILE_MASK[sq]])
+
+
+def _bishop_attacks(sq, occ):
+    return (_DIAG_ATT[sq][occ & _DIAG_MASK[sq]] |
+            _ANTI_ATT[sq][occ & _ANTI_MASK[sq]])
+
+
+def _bits(bb):
+    """Yield the square index of every set bit."""
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def _between_table():
+    """_BETWEEN[a][b]: the squares strictly between a and b when they share a
+    rank, file or diagonal (0 otherwise)."""
+    table = [[0] * 64 for _ in range(64)]
+    for a in range(64):
+        r, c = divmod(a, 8)
+        for dirs in _LINE_DIRS:
+            for dr, dc in dirs:
+                bb, nr, nc = 0, r + dr, c + dc
+                while in_bounds(nr, nc):
+                    table[a][nr * 8 + nc] = bb
+                    bb |= 1 << (nr * 8 + nc)
+                    nr += dr; nc += dc
+    return table
+
+
+_ALL_SQUARES  = (1 << 64) - 1
+_BETWEEN      = _between_table()
+_ROOK_RAYS    = [_rook_attacks(sq, 0) for sq in range(64)]     # empty-board lines
+_BISHOP_RAYS  = [_bishop_attacks(sq, 0) for sq in range(64)]
+
+
+class Position(Board):
+    """A Board that also keeps twelve piece bitboards (white pawn..king,
+    black pawn..king) in step with sq, so it goes anywhere a Board does.
+    Side to move and ep square are passed in, as for Board.  Every change
+    must go through make_move()/unmake_move()/promote_piece() (or _make()
+    plus track()), which keep the bitboards in step."""
+    __slots__ = ('bb',)
+
+    def __init__(self, sq=None, castling=0):
+        Board.__init__(self, sq, castling)
+        self.bb = [0] * 12
+        for s, code in enumerate(self.sq):
+            if code:
+                self.bb[_CODE_BB[code]] |= 1 << s
+
+    @classmethod
+    def from_board(cls, board):
+        return cls(board.sq, board.castling)
+
+    def to_board(self):
+        return Board(self.sq, self.castling)
+
+    def copy(self):
+        return Position(self.sq, self.castling)
+
+    def track(self, undo):
+        fr, to, piece, placed, captured, cap_sq, rf, rt, _rights = undo
+        bb = self.bb
+        bb[_CODE_BB[piece]]  ^= 1 << fr
+        bb[_CODE_BB[placed]] ^= 1 << to
+        if captured:
+            bb[_CODE_BB[captured]] ^= 1 << cap_sq
+        if rf >= 0:
+            bb[_CODE_BB[(piece & 8) | ROOK]] ^= (1 << rf) | (1 << rt)
+
+    def put(self, s, code):
+        old = self.sq[s]
+        if old:
+            self.bb[_CODE_BB[old]] ^= 1 << s
+        if code:
+            self.bb[_CODE_BB[code]] |= 1 << s
+        self.sq[s] = code
+
+    def legal_moves(self, us, ep_sq=-1, only=None):
+        """Legal (from_sq, to_sq, promo) moves for colour bit us, promo a type
+        code (0 = none); only keeps just those of the piece on that square.
+        Checkers and pins come from the king's lines, so nothing is made and
+        tested except en passant, checked against the king's lines again."""
+        bb    = self.bb
+        o, e  = (0, 6) if us == WHITE else (6, 0)
+        own   = bb[o] | bb[o + 1] | bb[o + 2] | bb[o + 3] | bb[o + 4] | bb[o + 5]
+        occ   = own | bb[e] | bb[e + 1] | bb[e + 2] | bb[e + 3] | bb[e + 4] | bb[e + 5]
+        pick  = _ALL_SQUARES if only is None else 1 << only
+        ksq   = bb[o + 5].bit_length() - 1
+        orth  = bb[e + 3] | bb[e + 4]
+        diag  = bb[e + 2] | bb[e + 4]
+        pawns, knights, king = bb[e], bb[e + 1], bb[e + 5]
+        pawn_att = _BB_PAWN_ATTACKS['white' if us == WHITE else 'black']
+
+        def attacked(s, occ):
+            return ((_BB_KNIGHT[s] & knights) or (pawn_att[s] & pawns) or (_BB_KING[s] & king)
+                    or (diag and _bishop_attacks(s, occ) & diag)
+                    or (orth and _rook_attacks(s, occ) & orth))
+
+        checkers = ((_BB_KNIGHT[ksq] & knights) | (pawn_att[ksq] & pawns) |
+                    (_bishop_attacks(ksq, occ) & diag) | (_rook_attacks(ksq, occ) & orth))
+        moves = []
+        add   = moves.append
+        if pick >> ksq & 1:
+            lifted = occ ^ (1 << ksq)   # the king cannot hide behind itself
+            for to in _bits(_BB_KING[ksq] & ~own):
+                if not attacked(to, lifted):
+                    add((ksq, to, 0))
+            rights = self.castling & (CASTLE_WK | CASTLE_WQ if us == WHITE else
+                                      CASTLE_BK | CASTLE_BQ)
+            if rights and not checkers:
+                if (rights & (CASTLE_WK | CASTLE_BK) and not occ & (0b11 << (ksq + 1))
+                        and not attacked(ksq + 1, occ) and not attacked(ksq + 2, occ)):
+                    add((ksq, ksq + 2, 0))
+                if (rights & (CASTLE_WQ | CASTLE_BQ) and not occ & (0b111 << (ksq - 3))
+                        and not attacked(ksq - 1, occ) and not attacked(ksq - 2, occ)):
+                    add((ksq, ksq - 2, 0))
+        if checkers & (checkers - 1):
+            return moves   # double check: only the king may move
+        if checkers:
+            target = checkers | _BETWEEN[ksq][checkers.bit_length() - 1]
+        else:
+            target = _ALL_SQUARES
+        target &= ~own
+
+        # A piece alone between the king and an enemy slider is pinned to
+        # that line
+        pins = {}
+        for s in _bits((_ROOK_RAYS[ksq] & orth) | (_BISHOP_RAYS[ksq] & diag)):
+            line  = _BETWEEN[ksq][s]
+            block = line & occ
+            if block & own and not block & (block - 1):
+                pins[block.bit_length() - 1] = line | (1 << s)
+
+        fwd, home = (-8, 6) if us == WHITE else (8, 1)
+        for s in _bits(bb[o] & pick):
+            to_bb = pawn_att[s] & occ & ~own
+            one   = s + fwd
+            if not occ >> one & 1:
+                to_bb |= 1 << one
+                if s >> 3 == home and not occ >> (one + fwd) & 1:
+                    to_bb |= 1 << (one + fwd)
+            to_bb &= target
+            if s in pins:
+                to_bb &= pins[s]
+            if ep_sq >= 0 and pawn_att[s] >> ep_sq & 1:
+                cap  = ep_sq - fwd
+                gone = occ ^ (1 << s) ^ (1 << cap) | (1 << ep_sq)
+                if ((target >> ep_sq & 1 or checkers >> cap & 1)
+                        and not _rook_attacks(ksq, gone) & orth
+                        and not _bishop_attacks(ksq, gone) & diag):
+                    add((s, ep_sq, 0))
+            for to in _bits(to_bb):
+                if to < 8 or to >= 56:
+                    for promo in _PROMO_CODES:
+                        add((s, to, promo))
+                else:
+                    add((s, to, 0))
+        for s in _bits(bb[o + 1] & pick):
+            if s not in pins:
+                for to in _bits(_BB_KNIGHT[s] & target):
+                    add((s, to, 0))
+        for s in _bits((bb[o + 2] | bb[o + 4]) & pick):
+            to_bb = _bishop_attacks(s, occ) & target
+            if s in pins:
+                to_bb &= pins[s]
+            for to in _bits(to_bb):
+                add((s, to, 0))
+        for s in _bits((bb[o + 3] | bb[o + 4]) & pick):
+            to_bb = _rook_attacks(s, occ) & target
+            if s in pins:
+                to_bb &= pins[s]
+            for to in _bits(to_bb):
+                add((s, to, 0))
+        return moves
+
+    def legal_moves_from(self, s, ep_sq=-1):
+        """legal_moves() of the piece on s only."""
+        code = self.sq[s]
+        return self.legal_moves(code & 8, ep_sq, s) if code else []
+
+
+# ---------------------------------------------------------------------------
+# Move-generation microbenchmark  (--bench-movegen)
+# ---------------------------------------------------------------------------
+def _raw_moves_reference(board, r, c, ep):
+    """The original bounds-checked generator (direction lists built per call,
+    a slide() closure, in_bounds() on every step), kept as the baseline for
+    bench_movegen() and as a cross-check of the precomputed tables."""
+    sq    = board.sq
+    piece = sq[r * 8 + c]
     if not piece:
         return []
-    color = piece.color
-    opp   = opponent(color)
+    own   = piece & 8
     moves = []
 
     def slide(dr, dc):
         nr, nc = r+dr, c+dc
         while in_bounds(nr, nc):
-            t = board[nr][nc]
-            if t is None:
+            t = sq[nr * 8 + nc]
+            if not t:
                 moves.append((nr, nc))
-            elif t.color == opp:
+            elif t & 8 != own:
                 moves.append((nr, nc)); break
             else:
                 break
             nr += dr; nc += dc
 
-    t = piece.type
-    if t == 'pawn':
-        d = -1 if color == 'white' else 1
+    t = piece & 7
+    if t == PAWN:
+        d = -1 if own == WHITE else 1
         nr = r + d
-        if in_bounds(nr, c) and board[nr][c] is None:
+        if in_bounds(nr, c) and not sq[nr * 8 + c]:
             moves.append((nr, c))
-            sr = 6 if color == 'white' else 1
-            if r == sr and board[r+2*d][c] is None:
+            sr = 6 if own == WHITE else 1
+            if r == sr and not sq[(r+2*d) * 8 + c]:
                 moves.append((r+2*d, c))
         for dc in (-1, 1):
             nc = c + dc
             if in_bounds(nr, nc):
-                tgt = board[nr][nc]
-                if tgt and tgt.color == opp:
+                tgt = sq[nr * 8 + nc]
+                if tgt and tgt & 8 != own:
                     moves.append((nr, nc))
                 if ep and (nr, nc) == ep:
                     moves.append((nr, nc))
-    elif t == 'knight':
+    elif t == KNIGHT:
         for dr, dc in [(-2,-1),(-2,1),(-1,-2),(-1,2),(1,-2),(1,2),(2,-1),(2,1)]:
             nr, nc = r+dr, c+dc
             if in_bounds(nr, nc):
-                tgt = board[nr][nc]
-                if tgt is None or tgt.color == opp:
+                tgt = sq[nr * 8 + nc]
+                if not tgt or tgt & 8 != own:
                     moves.append((nr, nc))
-    elif t == 'bishop':
+    elif t == BISHOP:
         for dr, dc in [(-1,-1),(-1,1),(1,-1),(1,1)]: slide(dr, dc)
-    elif t == 'rook':
+    elif t == ROOK:
         for dr, dc in [(-1,0),(1,0),(0,-1),(0,1)]: slide(dr, dc)
-    elif t == 'queen':
+    elif t == QUEEN:
         for dr, dc in [(-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)]: slide(dr, dc)
-    elif t == 'king':
+    elif t == KING:
         for dr, dc in [(-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)]:
             nr, nc = r+dr, c+dc
             if in_bounds(nr, nc):
-                tgt = board[nr][nc]
-                if tgt is None or tgt.color == opp:
+                tgt = sq[nr * 8 + nc]
+                if not tgt or tgt & 8 != own:
                     moves.append((nr, nc))
     return moves
 
 
-def sq_attacked(board, r, c, by_color):
-    for pr in range(8):
-        for pc in range(8):
-            p = board[pr][pc]
-            if p and p.color == by_color:
-                if (r, c) in raw_moves(board, pr, pc, None):
-                    return True
-    return False
+def bench_movegen(repeat=200):
+    """Time raw_moves() against the bounds-checked reference for every piece
+    of every PERFT_SUITE position.  Returns {type: (calls, ref_us, table_us)}."""
+    samples = {t: [] for t in PIECE_TYPES}
+    for _name, fen, _counts in PERFT_SUITE:
+        board, _turn, ep = parse_fen(fen)
+        for r in range(8):
+            for c in range(8):
+                if board[r][c]:
+                    assert (sorted(raw_moves(board, r, c, ep)) ==
+                            sorted(_raw_moves_reference(board, r, c, ep)))
+                    samples[board[r][c].type].append((board, r, c, ep))
+    result = {}
+    for t, items in samples.items():
+        timings = []
+        for fn in (_raw_moves_reference, raw_moves):
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                for board, r, c, ep in items:
+                    fn(board, r, c, ep)
+            timings.append((time.perf_counter() - t0) * 1e6 / (repeat * len(items)))
+        result[t] = (len(items) * repeat, timings[0], timings[1])
+    return result
 
 
-def is_in_check(board, color):
-    kr, kc = find_king(board, color)
-    return sq_attacked(board, kr, kc, opponent(color))
+def bench_movegen_main(args):
+    print(f"{'piece':<8} {'calls':>8} {'reference':>11} {'tables':>9} {'speedup':>8}")
+    for t, (calls, ref_us, tab_us) in bench_movegen().items():
+        print(f"{t:<8} {calls:>8} {ref_us:>9.2f}us {tab_us:>7.2f}us {ref_us / tab_us:>7.2f}x")
+    return 0
 
 
-def _apply_simple(board, r, c, mr, mc, ep):
-    piece = board[r][c]
-    if piece.type == 'pawn' and ep and (mr, mc) == ep:
-        board[r][mc] = None
-    board[mr][mc] = piece
-    board[r][c]   = None
+# ---------------------------------------------------------------------------
+# Zobrist hashing
+# One random 64-bit key per (piece, square), plus side to move (XORed in
+# when black is to move), one per castling-rights mask and one per ep file.
+# ---------------------------------------------------------------------------
+_ZOBRIST_RNG    = random.Random(0x2B1D5EED)
+ZOBRIST_PIECE   = [None] * 16   # piece code -> 64 square keys
+for _code in range(16):
+    if PIECES[_code]:
+        ZOBRIST_PIECE[_code] = [_ZOBRIST_RNG.getrandbits(64) for _ in range(64)]
+ZOBRIST_BLACK   = _ZOBRIST_RNG.getrandbits(64)
+ZOBRIST_CASTLE  = [0] + [_ZOBRIST_RNG.getrandbits(64) for _ in range(15)]
+ZOBRIST_EP_FILE = [_ZOBRIST_RNG.getrandbits(64) for _ in range(8)]
+# ep square index -> file key; index -1 (no ep square) hits the trailing 0
+_ZOBRIST_EP_SQ  = [ZOBRIST_EP_FILE[sq % 8] for sq in range(64)] + [0]
+
+
+def zobrist_key(board, turn, ep):
+    """Full O(64) key; states compute it once and then use zobrist_step()."""
+    key = 0
+    for sq, code in enumerate(board.sq):
+        if code:
+            key ^= ZOBRIST_PIECE[code][sq]
+    if turn == 'black':
+        key ^= ZOBRIST_BLACK
+    key ^= ZOBRIST_CASTLE[board.castling]
+    if ep:
+        key ^= ZOBRIST_EP_FILE[ep[1]]
+    return key
+
+
+def zobrist_step(key, undo, old_ep, new_ep, new_rights, switch_side=True):
+    """Key after the make_move() that produced undo, in O(1).  old_ep/new_ep
+    are (row, col) or None, new_rights the castling bitmask after the move;
+    switch_side=False leaves the side-to-move term alone (Play mode's
+    pending promotion)."""
+    key = _zobrist_move(key, undo, _ep_sq(old_ep), _ep_sq(new_ep), new_rights)
+    return key if switch_side else key ^ ZOBRIST_BLACK
+
+
+def _zobrist_move(key, undo, old_ep_sq, new_ep_sq, new_rights):
+    """zobrist_step() on square indices (-1 = no ep square), side always
+    switched; the search calls this directly."""
+    fr, to, piece, placed, captured, cap_sq, rf, rt, old_rights = undo
+    key ^= (ZOBRIST_PIECE[piece][fr] ^ ZOBRIST_PIECE[placed][to] ^ ZOBRIST_BLACK
+            ^ ZOBRIST_CASTLE[old_rights] ^ ZOBRIST_CASTLE[new_rights]
+            ^ _ZOBRIST_EP_SQ[old_ep_sq] ^ _ZOBRIST_EP_SQ[new_ep_sq])
+    if captured:
+        key ^= ZOBRIST_PIECE[captured][cap_sq]
+    if rf >= 0:
+        table = ZOBRIST_PIECE[(piece & 8) | ROOK]
+        key  ^= table[rf] ^ table[rt]
+    return key
+
+
+def zobrist_promote(key, color, sq, ptype):
+    """Key after the pawn on sq (row, col) became ptype and the turn passed."""
+    i = sq[0] * 8 + sq[1]
+    return (key ^ ZOBRIST_PIECE[piece_code(color, 'pawn')][i]
+            ^ ZOBRIST_PIECE[piece_code(color, ptype)][i] ^ ZOBRIST_BLACK)
 
 
-def legal_moves(board, r, c, ep):
-    piece = board[r][c]
-    if not piece:
-        return []
-    color  = piece.color
-    result = []
-    for mr, mc in raw_moves(board, r, c, ep):
-        tb = copy_board(board)
-        _apply_simple(tb, r, c, mr, mc, ep)
-        if not is_in_check(tb, color):
-            result.append((mr, mc))
-    # Castling
-    if piece.type == 'king' and not piece.has_moved and not is_in_check(board, color):
-        back = 7 if color == 'white' else 0
-        if r == back:
-            rk = board[back][7]
-            if (rk and rk.type == 'rook' and not rk.has_moved
-                    and board[back][5] is None and board[back][6] is None
-                    and not sq_attacked(board, back, 5, opponent(color))
-                    and not sq_attacked(board, back, 6, opponent(color))):
-                result.append((back, 6))
-            rk = board[back][0]
-            if (rk and rk.type == 'rook' and not rk.has_moved
-                    and board[back][1] is None and board[back][2] is None
-                    and board[back][3] is None
-                    and not sq_attacked(board, back, 3, opponent(color))
-                    and not sq_attacked(board, back, 2, opponent(color))):
-                result.append((back, 2))
+# ---------------------------------------------------------------------------
+# Perft  (move-generation correctness and speed)
+# ---------------------------------------------------------------------------
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Standard positions with published node counts for depth 1, 2, 3, ...
+PERFT_SUITE = [
+    ('start',     START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ('kiwipete',  'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862, 4085603]),
+    ('en-passant', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238, 674624]),
+    ('promotion', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467, 422333]),
+    ('mixed',     'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379, 2103487]),
+]
+PERFT_BASELINE   = 'perft_baseline.json'
+PERFT_SLOWDOWN   = 0.10    # nodes/second drop (fraction) flagged as a regression
+
+
+_PROMO_CODES = tuple(PIECE_TYPES.index(t) + 1 for t in PROMOTION_TYPES)
+
+
+def _perft(board, us, ep_sq, depth):
+    sq    = board.sq
+    moves = _legal_moves(board, us, ep_sq)
+    nodes = 0
+    for fr, to in moves:
+        piece   = sq[fr]
+        is_pawn = piece & 7 == PAWN
+        promos  = _PROMO_CODES if is_pawn and (to < 8 or to >= 56) else (0,)
+        if depth == 1:
+            nodes += len(promos)
+            continue
+        new_ep = (fr + to) // 2 if is_pawn and abs(to - fr) == 16 else -1
+        for promo in promos:
+            undo   = _make(board, fr, to, ep_sq, promo)
+            nodes += _perft(board, us ^ 8, new_ep, depth - 1)
+            _unmake(board, undo)
+    return nodes
+
+
+def _perft_position(pos, us, ep_sq, depth):
+    """_perft() with the Position move generator."""
+    moves = pos.legal_moves(us, ep_sq)
+    if depth == 1:
+        return len(moves)
+    sq    = pos.sq
+    nodes = 0
+    for fr, to, promo in moves:
+        new_ep = (fr + to) // 2 if sq[fr] & 7 == PAWN and abs(to - fr) == 16 else -1
+        undo   = _make(pos, fr, to, ep_sq, promo)
+        pos.track(undo)
+        nodes += _perft_position(pos, us ^ 8, new_ep, depth - 1)
+        _unmake(pos, undo)
+        pos.track(undo)
+    return nodes
+
+
+def perft(board, turn, ep, depth):
+    """Count leaf nodes of the legal move tree.  A Position is walked with
+    its bitboard generator, any other Board with _legal_moves()."""
+    if depth == 0:
+        return 1
+    if isinstance(board, Position):
+        return _perft_position(board, COLOR_BIT[turn], _ep_sq(ep), depth)
+    return _perft(board, COLOR_BIT[turn], _ep_sq(ep), depth)
+
+
+def perft_divide(board, turn, ep, depth):
+    """Per-root-move node counts as {'e2e4': n, 'e7e8q': n, ...}."""
+    result = {}
+    nxt = opponent(turn)
+    for (r, c), (mr, mc) in all_legal_moves(board, turn, ep):
+        is_pawn = board[r][c].type == 'pawn'
+        new_ep  = ((r + mr) // 2, c) if is_pawn and abs(mr - r) == 2 else None
+        for pt in (PROMOTION_TYPES if is_pawn and mr in (0, 7) else [None]):
+            undo = make_move(board, ((r, c), (mr, mc)), ep, pt)
+            result[move_to_uci((r, c), (mr, mc), pt)] = perft(board, nxt, new_ep, depth - 1)
+            unmake_move(board, undo)
     return result
 
 
-def all_legal_moves(board, color, ep):
-    moves = []
-    for r in range(8):
-        for c in range(8):
-            p = board[r][c]
-            if p and p.color == color:
-                for m in legal_moves(board, r, c, ep):
-                    moves.append(((r, c), m))
-    return moves
+def _perft_board(fen, bitboard):
+    board, turn, ep = parse_fen(fen)
+    if bitboard:
+        board = Position.from_board(board)
+    return board, turn, ep
 
 
-def apply_move(gs, r, c, mr, mc):
-    """Apply a fully-legal move to a GameState, handling all side-effects."""
-    board  = gs.board
-    piece  = board[r][c]
-    opp    = opponent(piece.color)
-    new_ep = None
+def run_perft(fen, depth, bitboard=False, divide=False):
+    """Time one perft run.  Returns a result dict (nodes, seconds, nps, divide)."""
+    board, turn, ep = _perft_board(fen, bitboard)
+    t0 = time.perf_counter()
+    if divide:
+        split = perft_divide(board, turn, ep, depth)
+        nodes = sum(split.values())
+    else:
+        split = None
+        nodes = perft(board, turn, ep, depth)
+    secs = time.perf_counter() - t0
+    return {'fen': fen, 'depth': depth, 'nodes': nodes, 'seconds': round(secs, 4),
+            'nps': int(nodes / secs) if secs > 0 else 0, 'divide': split}
+
+
+def perft_main(args):
+    """--perft entry point.  Returns a process exit code (1 on any mismatch
+    against published counts or regression against the baseline)."""
+    if args.fen:
+        jobs = [('fen', args.fen, None)]
+    else:
+        jobs = PERFT_SUITE
+    core = 'bitboard' if args.bitboard else 'board'
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get(core, {})
+
+    results = {}
+    failed  = False
+    for name, fen, expected in jobs:
+        depth = args.perft if expected is None else min(args.perft, len(expected))
+        res   = run_perft(fen, depth, args.bitboard, args.divide)
+        if res['divide']:
+            for mv in sorted(res['divide']):
+                print(f"  {mv:<6} {res['divide'][mv]}")
+        flags = []
+        if expected is not None and res['nodes'] != expected[depth - 1]:
+            flags.append(f"EXPECTED {expected[depth - 1]}")
+        base = baseline.get(name)
+        if base and base['depth'] == depth and base['fen'] == fen:
+            if base['nodes'] != res['nodes']:
+                flags.append(f"NODES CHANGED (baseline {base['nodes']})")
+            if res['nps'] < base['nps'] * (1 - PERFT_SLOWDOWN):
+                flags.append(f"SLOWER (baseline {base['nps']:,} nps)")
+        failed |= bool(flags)
+        print(f"{name:<11} depth {depth}  nodes {res['nodes']:>9}  "
+              f"{res['seconds']:8.3f}s  {res['nps']:>9,} nps  "
+              + ('  '.join(flags) if flags else 'ok'))
+        res.pop('divide')
+        results[name] = res
+
+    if args.save_baseline:
+        data = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                data = json.load(f)
+        data.setdefault(core, {}).update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        print(f"baseline saved to {args.baseline}")
+    return 1 if failed else 0
+
 
-    if piece.type == 'pawn' and gs.en_passant_target and (mr, mc) == gs.en_passant_target:
-        board[r][mc] = None
+# ---------------------------------------------------------------------------
+# Engine  (computer opponent for Play mode)
+# Iterative-deepening negamax alpha-beta on the square-index core, with a
+# transposition table keyed by Zobrist, null-move pruning, a captures-only
+# quiescence search and TT / MVV-LVA / killer / history move ordering.
+# Evaluation is material plus piece-square tables, kept incrementally.
+# ---------------------------------------------------------------------------
+ENGINE_MOVETIME    = 1.0       # seconds per move when no depth is given
+ENGINE_MAX_DEPTH   = 64
+ENGINE_TT_SIZE     = 1 << 17   # entries before the table is pruned (~250 bytes each)
+ENGINE_PONDER_TIME = 10.0      # seconds a ponder search may run (at least the move time)
+ENGINE_CHECK_EVERY = 1024      # nodes between clock / stop checks
+MATE_SCORE         = 100000
+MATE_BOUND         = MATE_SCORE - 1000   # beyond this a score is a mate in n
+TT_EXACT, TT_LOWER, TT_UPPER = 0, 1, 2
+
+PIECE_VALUE = (0, 100, 320, 330, 500, 900, 0)   # by type code
+
+# Piece-square tables from White's side, row 0 = rank 8 like the board;
+# Black reads them mirrored (sq ^ 56)
+_PST_TABLES = {
+    PAWN: (
+         0,  0,  0,  0,  0,  0,  0,  0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+         5,  5, 10, 25, 25, 10,  5,  5,
+         0,  0,  0, 20, 20,  0,  0,  0,
+         5, -5,-10,  0,  0,-10, -5,  5,
+         5, 10, 10,-20,-20, 10, 10,  5,
+         0,  0,  0,  0,  0,  0,  0,  0),
+    KNIGHT: (
+       -50,-40,-30,-30,-30,-30,-40,-50,
+       -40,-20,  0,  0,  0,  0,-20,-40,
+       -30,  0, 10, 15, 15, 10,  0,-30,
+       -30,  5, 15, 20, 20, 15,  5,-30,
+       -30,  0, 15, 20, 20, 15,  0,-30,
+       -30,  5, 10, 15, 15, 10,  5,-30,
+       -40,-20,  0,  5,  5,  0,-20,-40,
+       -50,-40,-30,-30,-30,-30,-40,-50),
+    BISHOP: (
+       -20,-10,-10,-10,-10,-10,-10,-20,
+       -10,  0,  0,  0,  0,  0,  0,-10,
+       -10,  0,  5, 10, 10,  5,  0,-10,
+       -10,  5,  5, 10, 10,  5,  5,-10,
+       -10,  0, 10, 10, 10, 10,  0,-10,
+       -10, 10, 10, 10, 10, 10, 10,-10,
+       -10,  5,  0,  0,  0,  0,  5,-10,
+       -20,-10,-10,-10,-10,-10,-10,-20),
+    ROOK: (
+         0,  0,  0,  0,  0,  0,  0,  0,
+         5, 10, 10, 10, 10, 10, 10,  5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+         0,  0,  0,  5,  5,  0,  0,  0),
+    QUEEN: (
+       -20,-10,-10, -5, -5,-10,-10,-20,
+       -10,  0,  0,  0,  0,  0,  0,-10,
+       -10,  0,  5,  5,  5,  5,  0,-10,
+        -5,  0,  5,  5,  5,  5,  0, -5,
+         0,  0,  5,  5,  5,  5,  0, -5,
+       -10,  5,  5,  5,  5,  5,  0,-10,
+       -10,  0,  5,  0,  0,  0,  0,-10,
+       -20,-10,-10, -5, -5,-10,-10,-20),
+    KING: (
+       -30,-40,-40,-50,-50,-40,-40,-30,
+       -30,-40,-40,-50,-50,-40,-40,-30,
+       -30,-40,-40,-50,-50,-40,-40,-30,
+       -30,-40,-40,-50,-50,-40,-40,-30,
+       -20,-30,-30,-40,-40,-30,-30,-20,
+       -10,-20,-20,-20,-20,-20,-20,-10,
+        20, 20,  0,  0,  0,  0, 20, 20,
+        20, 30, 10,  0,  0, 10, 30, 20),
+}
+# piece code -> 64 signed scores from White's point of view
+_PST = [None] * 16
+for _t, _table in _PST_TABLES.items():
+    _PST[WHITE | _t] = [PIECE_VALUE[_t] + _table[sq] for sq in range(64)]
+    _PST[BLACK | _t] = [-PIECE_VALUE[_t] - _table[sq ^ 56] for sq in range(64)]
+
+_SEARCH_PROMOS = (QUEEN, KNIGHT, ROOK, BISHOP)
+
+
+def evaluate(board):
+    """Static score in centipawns from White's point of view."""
+    return sum(_PST[code][sq] for sq, code in enumerate(board.sq) if code)
+
+
+class _SearchAbort(Exception):
+    pass
+
+
+class Engine:
+    """Search state that outlives one move: transposition table plus killer
+    and history tables.  search() never touches the board it is given.
+    interrupt, if given, is polled with the clock; returning True stops the
+    search as stop() does (EngineWorker passes its pipe's poll).  A tt
+    passed in (a SharedTT) belongs to the caller, who also clears it."""
+
+    def __init__(self, tt_size=ENGINE_TT_SIZE, interrupt=None, tt=None):
+        self.tt_size   = tt_size
+        # zobrist key -> (depth, flag, score, move); a dict, or a SharedTT
+        self.tt        = {} if tt is None else tt
+        self.own_tt    = tt is None
+        self.stopped   = False
+        self.interrupt = interrupt
+        self.clear()
+
+    def clear(self):
+        """Forget everything learnt so far (new game)."""
+        if self.own_tt:
+            self.tt.clear()
+        self.history = [[0] * 64 for _ in range(16)]
+        self.killers = [[None, None] for _ in range(2 * ENGINE_MAX_DEPTH + 1)]
+
+    def stop(self):
+        """Ask a running search to return its last completed iteration."""
+        self.stopped = True
+
+    def _out_of_time(self):
+        return (self.stopped or (self.deadline and time.perf_counter() > self.deadline)
+                or (self.interrupt is not None and self.interrupt()))
+
+    # -- search ------------------------------------------------------------
+    def search(self, board, turn, ep=None, depth=None, movetime=None, on_iter=None,
+               first_depth=1):
+        """Best move for turn.  depth caps the iteration depth; movetime (s)
+        the wall time, defaulting to ENGINE_MOVETIME when depth is None.
+        on_iter(result) is called after each completed iteration; lazy-SMP
+        helpers start at a later first_depth to spread the work.  Returns
+        {'move': ((r, c), (mr, mc), promotion or None) or None, 'score',
+        'depth', 'nodes', 'seconds', 'nps', 'pv': [uci, ...]}."""
+        board = Board(board.sq, board.castling)   # a Position's bitboards are not needed
+        if movetime is None and depth is None:
+            movetime = ENGINE_MOVETIME
+        t0 = time.perf_counter()
+        self.deadline = t0 + movetime if movetime else None
+        self.stopped  = False
+        self.nodes    = 0
+        us     = COLOR_BIT[turn]
+        ep_sq  = _ep_sq(ep)
+        key    = zobrist_key(board, turn, ep)
+        score  = evaluate(board)
+        result = {'move': None, 'score': 0, 'depth': 0, 'nodes': 0,
+                  'seconds': 0.0, 'nps': 0, 'pv': []}
+        for k in self.killers:
+            k[0] = k[1] = None
+
+        max_depth = depth or ENGINE_MAX_DEPTH
+        for d in range(min(first_depth, max_depth), max_depth + 1):
+            self.root_move = None
+            try:
+                value = self._negamax(board, us, ep_sq, key, score, d,
+                                      -MATE_SCORE - 1, MATE_SCORE + 1, 0, True)
+            except _SearchAbort:
+                break
+            if self.root_move is None:
+                break   # no legal moves at the root
+            fr, to, promo = self.root_move
+            secs = time.perf_counter() - t0
+            result = {'move': (_RC[fr], _RC[to], PIECE_TYPES[promo - 1] if promo else None),
+                      'score': value, 'depth': d, 'nodes': self.nodes,
+                      'seconds': round(secs, 4),
+                      'nps': int(self.nodes / secs) if secs > 0 else 0,
+                      'pv': self._pv(board, us, ep_sq, key, d, self.root_move)}
+            if on_iter:
+                on_iter(result)
+            if abs(value) >= MATE_BOUND:
+                break
+            # Another iteration costs several times this one; skip it when
+            # it cannot finish in time
+            if self.deadline and time.perf_counter() + secs * 2 > self.deadline:
+                break
+        secs = time.perf_counter() - t0
+        result.update(nodes=self.nodes, seconds=round(secs, 4),
+                      nps=int(self.nodes / secs) if secs > 0 else 0)
+        return result
+
+    def move_values(self, board, turn, ep=None, depth=1, moves=None, bound=None,
+                    stop_after=None):
+        """Value of each legal move for turn (or of just moves, (fr, to, promo)
+        triples) from a depth-ply search.  With bound every move gets a
+        null-window test instead, far cheaper: a value >= bound means the
+        move really scores >= bound, anything lower that it does not; and
+        stop_after ends the scan once that many moves have reached bound.
+        Returns {(fr, to, promo): value}."""
+        board = board.copy()
+        self.deadline = None
+        self.stopped  = False
+        self.nodes    = 0
+        us     = COLOR_BIT[turn]
+        ep_sq  = _ep_sq(ep)
+        key    = zobrist_key(board, turn, ep)
+        score  = evaluate(board)
+        if moves is None:
+            moves = self._ordered(board, _legal_moves(board, us, ep_sq), ep_sq, None, 0)
+        alpha, beta = (-MATE_SCORE - 1, MATE_SCORE + 1) if bound is None else (bound - 1, bound)
+        values, hits = {}, 0
+        for m in moves:
+            fr, to, promo = m
+            undo, new_ep, nkey, nscore = self._play(board, fr, to, ep_sq, promo, key, score)
+            try:
+                values[m] = -self._negamax(board, us ^ 8, new_ep, nkey, nscore, depth - 1,
+                                           -beta, -alpha, 1, True)
+            finally:
+                _unmake(board, undo)
+            if bound is not None and values[m] >= bound:
+                hits += 1
+                if hits == stop_after:
+                    break
+        return values
+
+    def quiet_value(self, board, turn, ep=None):
+        """Captures-only value for turn: what the position is worth before
+        any quiet move, i.e. once pending exchanges are played out."""
+        board = board.copy()
+        self.deadline = None
+        self.stopped  = False
+        self.nodes    = 0
+        return self._quiesce(board, COLOR_BIT[turn], _ep_sq(ep), zobrist_key(board, turn, ep),
+                             evaluate(board), -MATE_SCORE - 1, MATE_SCORE + 1)
+
+    def _pv(self, board, us, ep_sq, key, depth, move):
+        """Principal variation from move on, as UCI strings; the rest is read
+        back from the TT."""
+        pv, undos = [], []
+        while move and len(pv) < depth:
+            fr, to, promo = move
+            if (fr, to) not in _legal_moves(board, us, ep_sq):
+                break
+            pv.append(move_to_uci(_RC[fr], _RC[to], PIECE_TYPES[promo - 1] if promo else None))
+            undo, ep_sq, key, _score = self._play(board, fr, to, ep_sq, promo, key, 0)
+            undos.append(undo)
+            us ^= 8
+            entry = self.tt.get(key)
+            move  = entry and entry[3]
+        for undo in reversed(undos):
+            _unmake(board, undo)
+        return pv
+
+    @staticmethod
+    def _play(board, fr, to, ep_sq, promo, key, score):
+        """_make() plus the incremental key and evaluation.
+        Returns (undo, new ep square, key, score)."""
+        undo = _make(board, fr, to, ep_sq, promo)
+        _fr, _to, piece, placed, captured, cap_sq, rf, rt, _rights = undo
+        new_ep = (fr + to) // 2 if piece & 7 == PAWN and abs(to - fr) == 16 else -1
+        score += _PST[placed][to] - _PST[piece][fr]
+        if captured:
+            score -= _PST[captured][cap_sq]
+        if rf >= 0:
+            rook   = _PST[(piece & 8) | ROOK]
+            score += rook[rt] - rook[rf]
+        return undo, new_ep, _zobrist_move(key, undo, ep_sq, new_ep, board.castling), score
+
+    def _ordered(self, board, moves, ep_sq, tt_move, ply):
+        """Expand promotions and sort: TT move, captures by MVV-LVA,
+        promotions, killers, then history."""
+        sq      = board.sq
+        killers = self.killers[ply]
+        history = self.history
+        scored  = []
+        for fr, to in moves:
+            piece  = sq[fr]
+            victim = sq[to] & 7
+            if piece & 7 == PAWN:
+                if to < 8 or to >= 56:
+                    for promo in _SEARCH_PROMOS:
+                        m = (fr, to, promo)
+                        scored.append((2000000 if m == tt_move else
+                                       900000 + PIECE_VALUE[promo] + PIECE_VALUE[victim], m))
+                    continue
+                if to == ep_sq:
+                    victim = PAWN
+            m = (fr, to, 0)
+            if m == tt_move:
+                v = 2000000
+            elif victim:
+                v = 1000000 + PIECE_VALUE[victim] * 10 - PIECE_VALUE[piece & 7] // 10
+            elif m == killers[0]:
+                v = 800000
+            elif m == killers[1]:
+                v = 799999
+            else:
+                v = history[piece][to]
+            scored.append((v, m))
+        scored.sort(reverse=True)
+        return [m for _v, m in scored]
+
+    def _negamax(self, board, us, ep_sq, key, score, depth, alpha, beta, ply, allow_null):
+        self.nodes += 1
+        if self.nodes % ENGINE_CHECK_EVERY == 0 and self._out_of_time():
+            raise _SearchAbort
+
+        sq       = board.sq
+        in_check = _is_attacked(sq, sq.index(us | KING), us ^ 8)
+        if in_check:
+            depth += 1
+        if depth <= 0:
+            return self._quiesce(board, us, ep_sq, key, score, alpha, beta)
+
+        alpha0  = alpha
+        entry   = self.tt.get(key)
+        tt_move = None
+        if entry:
+            e_depth, flag, value, tt_move = entry
+            if e_depth >= depth and ply:
+                if value > MATE_BOUND:
+                    value -= ply
+                elif value < -MATE_BOUND:
+                    value += ply
+                if (flag == TT_EXACT or (flag == TT_LOWER and value >= beta)
+                        or (flag == TT_UPPER and value <= alpha)):
+                    return value
+
+        # Null move: if passing still fails high, a real move would too.
+        # Skipped in check and when only pawns are left (zugzwang).
+        if (allow_null and not in_check and depth >= 3 and ply
+                and any(sq.find(us | t) >= 0 for t in (KNIGHT, BISHOP, ROOK, QUEEN))):
+            nkey  = key ^ ZOBRIST_BLACK ^ _ZOBRIST_EP_SQ[ep_sq]
+            value = -self._negamax(board, us ^ 8, -1, nkey, score, depth - 3,
+                                   -beta, -beta + 1, ply + 1, False)
+            if value >= beta:
+                return beta
+
+        moves = _legal_moves(board, us, ep_sq)
+        if not moves:
+            return -MATE_SCORE + ply if in_check else 0
+
+        best, best_move = -MATE_SCORE - 1, None
+        for m in self._ordered(board, moves, ep_sq, tt_move, ply):
+            fr, to, promo = m
+            undo, new_ep, nkey, nscore = self._play(board, fr, to, ep_sq, promo, key, score)
+            try:
+                value = -self._negamax(board, us ^ 8, new_ep, nkey, nscore, depth - 1,
+                                       -beta, -alpha, ply + 1, True)
+            finally:
+                _unmake(board, undo)
+            if value > best:
+                best, best_move = value, m
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        if not undo[4] and not promo:
+                            killers = self.killers[ply]
+                            if killers[0] != m:
+                                killers[1], killers[0] = killers[0], m
+                            self.history[undo[2]][to] += depth * depth
+                        break
+
+        stored = best
+        if stored > MATE_BOUND:
+            stored += ply
+        elif stored < -MATE_BOUND:
+            stored -= ply
+        flag = TT_UPPER if best <= alpha0 else TT_LOWER if best >= beta else TT_EXACT
+        if isinstance(self.tt, dict) and len(self.tt) >= self.tt_size and key not in self.tt:
+            self._make_room()
+        self.tt[key] = (depth, flag, stored, best_move)
+        if not ply:
+            self.root_move = best_move
+        return best
+
+    def _make_room(self):
+        """The dict TT is full: keep the entries searched deeper than one ply,
+        the costly ones, or start over if that frees too little."""
+        deep = {k: e for k, e in self.tt.items() if e[0] > 1}
+        self.tt.clear()
+        if len(deep) <= self.tt_size // 2:
+            self.tt.update(deep)
+
+    def _quiesce(self, board, us, ep_sq, key, score, alpha, beta):
+        """Captures and promotions only, until the position is quiet."""
+        self.nodes += 1
+        if self.nodes % ENGINE_CHECK_EVERY == 0 and self._out_of_time():
+            raise _SearchAbort
+        stand = score if us == WHITE else -score
+        if stand >= beta:
+            return stand
+        if stand > alpha:
+            alpha = stand
+        sq    = board.sq
+        noisy = [(fr, to) for fr, to in _legal_moves(board, us, ep_sq)
+                 if sq[to] or (sq[fr] & 7 == PAWN and (to == ep_sq or to < 8 or to >= 56))]
+        for fr, to, promo in self._ordered(board, noisy, ep_sq, None, 0):
+            if promo and promo != QUEEN:
+                continue
+            undo, new_ep, nkey, nscore = self._play(board, fr, to, ep_sq, promo, key, score)
+            try:
+                value = -self._quiesce(board, us ^ 8, new_ep, nkey, nscore, -beta, -alpha)
+            finally:
+                _unmake(board, undo)
+            if value >= beta:
+                return value
+            if value > alpha:
+                alpha = value
+        return alpha
 
-    if piece.type == 'king' and abs(mc - c) == 2:
-        back = r
-        if mc == 6:
-            board[back][5] = board[back][7]; board[back][7] = None
-            if board[back][5]: board[back][5].has_moved = True
-        elif mc == 2:
-            board[back][3] = board[back][0]; board[back][0] = None
-            if board[back][3]: board[back][3].has_moved = True
 
-    if piece.type == 'pawn' and abs(mr - r) == 2:
-        new_ep = ((r + mr) // 2, c)
+# ---------------------------------------------------------------------------
+# Shared transposition table  (lazy SMP)
+# One fixed-size table in multiprocessing.shared_memory that every search
+# process reads and writes without locks.  A slot is two 64-bit words,
+# key ^ data and data; a slot torn by two concurrent writers no longer
+# XORs back to its key and simply reads as a miss.  The word after the
+# last slot is the stop flag for the current job.
+# ---------------------------------------------------------------------------
+SHARED_TT_ENTRIES = 1 << 20   # 16 bytes each; must be a power of two
+_TT_SCORE_BIAS    = 1 << 17   # scores are stored biased to stay unsigned
 
-    board[mr][mc]   = piece
-    board[r][c]     = None
-    piece.has_moved = True
 
-    promote_row = 0 if piece.color == 'white' else 7
-    if piece.type == 'pawn' and mr == promote_row:
-        gs.promotion_pending = (mr, mc)
-        gs.promotion_color   = piece.color
-        gs.en_passant_target = new_ep
-        gs.last_move = ((r, c), (mr, mc))
+class SharedTT:
+    """dict-like TT (get / [key] = entry / clear) over shared memory.
+    name=None creates the block; otherwise an existing one is attached."""
+
+    def __init__(self, entries=SHARED_TT_ENTRIES, name=None):
+        if name is None:
+            self.shm   = shared_memory.SharedMemory(create=True, size=entries * 16 + 8)
+            self.owner = True
+        else:
+            # Children started through multiprocessing share the creator's
+            # resource tracker, so attaching adds no second registration
+            self.shm   = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name    = self.shm.name
+        self.entries = entries
+        self.mask    = entries - 1
+        self.words   = self.shm.buf.cast('Q')
+        self.stop_at = entries * 2
+
+    def get(self, key):
+        i    = (key & self.mask) << 1
+        w    = self.words
+        data = w[i + 1]
+        if w[i] ^ data != key or not data:
+            return None
+        move = data >> 28
+        return (data & 0xFF, (data >> 8) & 3,
+                ((data >> 10) & 0x3FFFF) - _TT_SCORE_BIAS,
+                (move >> 9 & 63, move >> 3 & 63, move & 7) if move else None)
+
+    def __setitem__(self, key, entry):
+        depth, flag, score, move = entry
+        i   = (key & self.mask) << 1
+        w   = self.words
+        old = w[i + 1]
+        if w[i] ^ old == key and (old & 0xFF) > depth:
+            return   # keep the deeper result for the same position
+        data = depth | flag << 8 | (score + _TT_SCORE_BIAS) << 10
+        if move:
+            data |= (1 << 15 | move[0] << 9 | move[1] << 3 | move[2]) << 28
+        w[i]     = key ^ data
+        w[i + 1] = data
+
+    def clear(self):
+        self.shm.buf[:self.stop_at * 8] = bytes(self.stop_at * 8)
+
+    @property
+    def stopped(self):
+        return self.words[self.stop_at] != 0
+
+    def set_stop(self, flag):
+        self.words[self.stop_at] = 1 if flag else 0
+
+    def close(self):
+        self.words.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# ---------------------------------------------------------------------------
+# Engine worker  (searches in child processes so the UI keeps its frame rate)
+# One job runs at a time.  Any message from the UI interrupts the running
+# search (the engines poll their pipes); results of superseded or cancelled
+# jobs are dropped by job id.  With threads > 1 every process searches the
+# same root through a SharedTT (lazy SMP); once process 0 finishes the rest
+# are stopped and the deepest completed iteration wins.
+# ---------------------------------------------------------------------------
+def _engine_worker(conn, index=0, tt_name=None, tt_entries=SHARED_TT_ENTRIES,
+                   tt_size=ENGINE_TT_SIZE):
+    tt = SharedTT(tt_entries, tt_name) if tt_name else None
+    if tt:
+        engine = Engine(interrupt=lambda: tt.stopped or conn.poll(), tt=tt)
+    else:
+        engine = Engine(tt_size, interrupt=conn.poll)
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        kind, job_id, args = msg
+        if kind == 'search':
+            packed, turn, ep, depth, movetime = args
+            # Helpers start one or two plies deeper so they do not all
+            # walk the same tree in lockstep
+            conn.send((job_id, engine.search(Board.unpack(packed), turn, ep,
+                                             depth=depth, movetime=movetime,
+                                             first_depth=1 + index % 3)))
+        elif kind == 'clear':
+            engine.clear()
+        # 'cancel' and 'stop' need no work: receiving either already
+        # stopped the search, and the UI decides whether to keep the result
+    if tt:
+        tt.close()
+
+
+class EngineWorker:
+    """Handle on the search processes, started by start() or the first submit()."""
+
+    def __init__(self, threads=1, tt_entries=SHARED_TT_ENTRIES, tt_size=ENGINE_TT_SIZE):
+        self.threads    = max(1, threads)
+        self.tt_entries = tt_entries
+        self.tt_size    = tt_size      # dict TT entries, when threads == 1
+        self.tt         = None
+        self.conns      = []
+        self.procs      = []
+        self.last_id    = 0
+        self.pending    = None   # id of the job whose result is still wanted
+        self.results    = {}     # process index -> result of the pending job
+
+    def start(self):
+        """Start the processes now rather than on the first submit()."""
+        if self.procs:
+            return
+        # spawn, not fork: the UI process has SDL state a child must not inherit
+        ctx = multiprocessing.get_context('spawn')
+        if self.threads > 1:
+            # Cleared here, once; the processes only attach to it
+            self.tt = SharedTT(self.tt_entries)
+            self.tt.clear()
+        for i in range(self.threads):
+            conn, child = ctx.Pipe()
+            proc = ctx.Process(target=_engine_worker, daemon=True,
+                               args=(child, i, self.tt and self.tt.name, self.tt_entries,
+                                     self.tt_size))
+            proc.start()
+            self.conns.append(conn)
+            self.procs.append(proc)
+
+    def _send(self, msg):
+        self.start()
+        for conn in self.conns:
+            conn.send(msg)
+
+    def submit(self, board, turn, ep=None, depth=None, movetime=None):
+        """Start searching; returns the job id.  Supersedes any pending job."""
+        self.last_id += 1
+        self.pending  = self.last_id
+        self.results  = {}
+        if self.tt:
+            self.tt.set_stop(False)
+        self._send(('search', self.last_id, (board.pack(), turn, ep, depth, movetime)))
+        return self.last_id
+
+    def poll(self, job_id):
+        """Result dict of job_id once it is done, else None.  Never blocks."""
+        try:
+            for i, conn in enumerate(self.conns):
+                while conn.poll():
+                    done_id, result = conn.recv()
+                    if done_id == job_id == self.pending:
+                        self.results[i] = result
+                        if i == 0 and self.tt:
+                            self.tt.set_stop(True)
+        except (EOFError, OSError):
+            # A process died; the next submit() starts a fresh set
+            self.close()
+            return None
+        if job_id != self.pending or len(self.results) < len(self.conns):
+            return None
+        self.pending = None
+        return self._merge()
+
+    def _merge(self):
+        """Deepest completed iteration (process 0 on ties), with the node
+        count and speed of all processes together."""
+        results = self.results
+        best    = dict(max(results.values(), key=lambda r: r['depth']))
+        if results[0]['depth'] == best['depth']:
+            best = dict(results[0])
+        main = results[0]
+        best['nodes']   = sum(r['nodes'] for r in results.values())
+        best['seconds'] = main['seconds']
+        best['nps']     = int(best['nodes'] / main['seconds']) if main['seconds'] else 0
+        return best
+
+    def wait(self, job_id, timeout=None):
+        """Block until job_id is done (or timeout s passes); result or None."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            result = self.poll(job_id)
+            if result is not None or self.pending != job_id:
+                return result
+            left = None if deadline is None else deadline - time.perf_counter()
+            if left is not None and left <= 0:
+                return None
+            connection.wait(self.conns, left)
+
+    def stop(self, job_id):
+        """Finish job_id now; its result still arrives, holding whatever
+        iterations completed."""
+        if job_id == self.pending:
+            if self.tt:
+                self.tt.set_stop(True)
+            self._send(('stop', job_id, None))
+
+    def cancel(self, job_id=None):
+        """Stop the pending job (if it is job_id, when given) and drop its result."""
+        if self.pending is not None and job_id in (None, self.pending):
+            self._send(('cancel', self.pending, None))
+            self.pending = None
+
+    def clear(self):
+        """New game: forget the workers' transposition and ordering tables."""
+        if self.tt:
+            self.tt.clear()
+        if self.procs:
+            self._send(('clear', 0, None))
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for proc in self.procs:
+            proc.join(timeout=1.0)
+            if proc.is_alive():
+                proc.terminate()
+        for conn in self.conns:
+            conn.close()
+        if self.tt:
+            self.tt.close()
+        self.tt, self.conns, self.procs, self.pending = None, [], [], None
+
+
+ENGINE_BENCH = [fen for _name, fen, _counts in PERFT_SUITE] + [
+    'r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4',
+    '2b2k2/1p2q1p1/p4p1p/3pN3/3P4/7P/PP1Q1PP1/6K1 w - - 0 1',
+]
+
+
+def bench_engine_main(args):
+    """--bench-engine: search every ENGINE_BENCH position and report depth
+    reached and nodes/second."""
+    engine   = Engine()
+    total_n  = total_s = 0
+    for fen in ENGINE_BENCH:
+        board, turn, ep = parse_fen(fen)
+        engine.clear()
+        res = engine.search(board, turn, ep, depth=args.engine_depth,
+                            movetime=args.engine_time)
+        total_n += res['nodes']; total_s += res['seconds']
+        print(f"depth {res['depth']:>2}  {res['nodes']:>8} nodes  {res['nps']:>7,} nps  "
+              f"score {res['score']:>6}  pv {' '.join(res['pv'][:6])}")
+    print(f"total {total_n} nodes in {total_s:.2f}s: {int(total_n / (total_s or 1e-9)):,} nps")
+    return 0
+
+
+def bench_smp_main(args):
+    """--bench-smp: time to reach a fixed depth on ENGINE_BENCH with one
+    process and with --threads processes, and the resulting speedup."""
+    depth  = args.engine_depth or 5
+    counts = sorted({1, max(1, args.threads)})
+    times  = {}
+    cores  = os.cpu_count() or 1
+    if counts[-1] > cores:
+        print(f"note: {counts[-1]} processes on {cores} core(s); expect no speedup")
+    for n in counts:
+        worker = EngineWorker(n)
+        worker.start()
+        worker.wait(worker.submit(make_board(), 'white', depth=1))   # warm up
+        total = 0.0
+        for fen in ENGINE_BENCH:
+            board, turn, ep = parse_fen(fen)
+            worker.clear()
+            t0  = time.perf_counter()
+            res = worker.wait(worker.submit(board, turn, ep, depth=depth))
+            total += time.perf_counter() - t0
+            print(f"{n:>2} proc  depth {res['depth']:>2}  {res['nodes']:>8} nodes  "
+                  f"{res['nps']:>9,} nps  {res['seconds']:6.2f}s  {' '.join(res['pv'][:4])}")
+        worker.close()
+        times[n] = total
+        print(f"{n:>2} proc  total {total:.2f}s to depth {depth}")
+    if len(counts) > 1:
+        print(f"speedup x{times[1] / times[counts[-1]]:.2f} with {counts[-1]} processes")
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# Puzzle validation  (--validate-puzzles)
+# Each solution is replayed through the move generator.  At every solver
+# ply a bounded search scores the solution move and null-window tests the
+# rest; a second move that also wins makes the puzzle ambiguous.  A process
+# pool takes puzzles in chunks and the report is written as they finish.
+# ---------------------------------------------------------------------------
+VALIDATE_DEPTH  = 3      # plies searched behind each solver move
+VALIDATE_CHUNK  = 8      # puzzles handed to a pool process at a time
+PUZZLE_WIN_CP   = 300    # gain over the captures-only value (about a piece) that wins
+_SQLITE_MAGIC   = b'SQLite format 3\x00'
+
+
+def iter_puzzle_file(path):
+    """(key, entry) for every puzzle in an SQLite puzzle store or an EPD
+    pack.  EPD records take their key from 'id' and their solution from
+    'pv' (or a single 'bm'), kept as SAN for validate_puzzle() to decode.
+    A record that does not parse becomes an entry keyed file#line holding
+    just the 'error', so it is reported with the other failures."""
+    with open(path, 'rb') as f:
+        magic = f.read(len(_SQLITE_MAGIC))
+    if magic == _SQLITE_MAGIC:
+        store = PuzzleStore(path)
+        try:
+            yield from store.items(mode='puzzle')
+        finally:
+            store.close()
         return
+    name = os.path.basename(path)
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                board, turn, ep, ops = read_epd(line)
+            except ValueError as e:
+                yield f"{name}#{line_no}", {'mode': 'puzzle', 'error': f"bad epd: {e}"}
+                continue
+            key = ops['id'][0] if ops.get('id') else f"{name}#{line_no}"
+            yield key, {'mode': 'puzzle', 'fen': write_fen(board, turn, ep),
+                        'solution_san': ops.get('pv') or ops.get('bm', [])[:1],
+                        'free_play': False}
+
+
+def _solution_move(board, us, ep_sq, gm, ply):
+    """(fr, to, promo) of the solution's ply-th move; ValueError if unreadable."""
+    if 'solution_san' in gm:
+        return _san_to_sq(board, us, ep_sq, gm['solution_san'][ply])
+    m = gm['solution'][ply]
+    r, c   = alg_to_rc(m[0])
+    mr, mc = alg_to_rc(m[1])
+    fr, to = r * 8 + c, mr * 8 + mc
+    # Puzzle mode auto-queens, so a pawn reaching the last rank is a queen
+    promo = PIECE_TYPES.index(m[2]) + 1 if len(m) > 2 and m[2] else 0
+    if not promo and board.sq[fr] & 7 == PAWN and (to < 8 or to >= 56):
+        promo = QUEEN
+    return fr, to, promo
+
+
+def validate_puzzle(key, gm, depth=VALIDATE_DEPTH, engine=None):
+    """Check one puzzle entry.  Returns a JSON-ready report: 'errors' make
+    the puzzle unplayable (bad FEN, illegal or unreadable solution move),
+    'flags' mark a playable but doubtful one (a solution move that does not
+    win at this depth, or 'alternatives' that win as well)."""
+    t0     = time.perf_counter()
+    report = {'key': key, 'ok': True, 'errors': [], 'flags': [], 'alternatives': {},
+              'scores': []}
+    engine = engine or Engine()
+    if 'error' in gm:   # the record itself did not parse
+        report['errors'].append(gm['error'])
+    else:
+        try:
+            board, turn, ep = parse_fen(gm['fen'])
+        except (KeyError, ValueError) as e:
+            report['errors'].append(f"bad fen: {e}")
+        else:
+            _check_puzzle(report, gm, board, turn, ep, depth, engine)
+    report['ok']      = not report['errors']
+    report['seconds'] = round(time.perf_counter() - t0, 4)
+    return report
 
-    gs.en_passant_target = new_ep
-    gs.last_move = ((r, c), (mr, mc))
-    gs.turn = opp
-    _update_status(gs)
+
+def _check_puzzle(report, gm, board, turn, ep, depth, engine):
+    errors, flags = report['errors'], report['flags']
+    us, ep_sq = COLOR_BIT[turn], _ep_sq(ep)
+    if _is_attacked(board.sq, board.sq.index((us ^ 8) | KING), us):
+        errors.append("side not to move is in check")
+        return
+    if gm.get('free_play'):
+        if not _legal_moves(board, us, ep_sq):
+            errors.append("no legal moves")
+        return
+    n = len(gm.get('solution_san', gm.get('solution', ())))
+    if not n:
+        errors.append("empty solution")
+        return
+    # Gains are measured against the start, so a combination's last capture
+    # still counts as winning even though it is pending by then
+    base = engine.quiet_value(board, turn, ep)
+    for ply in range(n):
+        try:
+            fr, to, promo = _solution_move(board, us, ep_sq, gm, ply)
+        except (ValueError, IndexError, TypeError) as e:
+            errors.append(f"ply {ply + 1}: unreadable move: {e}")
+            return
+        uci = move_to_uci(_RC[fr], _RC[to], PIECE_TYPES[promo - 1] if promo else None)
+        if (fr, to) not in _legal_moves(board, us, ep_sq):
+            errors.append(f"ply {ply + 1}: illegal move {uci}")
+            return
+        if ply == 0 and gm.get('hint_sq') and gm['hint_sq'] != rc_to_alg(*_RC[fr]):
+            flags.append(f"hint_sq {gm['hint_sq']} is not the first move's square")
+        if ply % 2 == 0:
+            _check_solver_ply(report, board, turn, ep, depth, engine, ply,
+                              (fr, to, promo), uci, base)
+        undo = _make(board, fr, to, ep_sq, promo)
+        ep_sq = (fr + to) // 2 if undo[2] & 7 == PAWN and abs(to - fr) == 16 else -1
+        ep    = _RC[ep_sq] if ep_sq >= 0 else None
+        us   ^= 8
+        turn  = opponent(turn)
+
+
+def _check_solver_ply(report, board, turn, ep, depth, engine, ply, move, uci, base):
+    value = engine.move_values(board, turn, ep, depth, moves=[move])[move]
+    report['scores'].append(value)
+    if value < base + PUZZLE_WIN_CP:
+        report['flags'].append(f"ply {ply + 1}: {uci} scores {value} against {base} "
+                               f"at the start, depth {depth}")
+        return
+    # A mate is only matched by another mate, any other win by any win.
+    # Under-promotions on the solution's own squares are the same idea.
+    bound = MATE_BOUND if value >= MATE_BOUND else base + PUZZLE_WIN_CP
+    wins  = [move_to_uci(_RC[fr], _RC[to], PIECE_TYPES[promo - 1] if promo else None)
+             for (fr, to, promo), v in engine.move_values(board, turn, ep, depth,
+                                                          bound=bound).items()
+             if v >= bound and (fr, to) != move[:2]]
+    if wins:
+        report['alternatives'][str(ply + 1)] = wins
+        report['flags'].append(f"ply {ply + 1}: {len(wins)} other winning move(s)")
 
 
-def _update_status(gs):
-    color = gs.turn
-    chk   = is_in_check(gs.board, color)
-    has_m = bool(all_legal_moves(gs.board, color, gs.en_passant_target))
-    if chk and not has_m:
-        gs.status = 'checkmate'
-    elif not chk and not has_m:
-        gs.status = 'stalemate'
-    elif chk:
-        gs.status = 'check'
+_validator = None
+
+
+def _validate_init(depth):
+    global _validator
+    _validator = (Engine(), depth)
+
+
+def _validate_job(item):
+    engine, depth = _validator
+    engine.clear()
+    return validate_puzzle(item[0], item[1], depth, engine)
+
+
+def validate_puzzles(items, depth=VALIDATE_DEPTH, jobs=None):
+    """Yield a validate_puzzle() report per (key, entry) in items, in
+    completion order, fanned out over jobs processes (default: one per CPU;
+    1 runs in this process)."""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        _validate_init(depth)
+        yield from map(_validate_job, items)
+        return
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(jobs, _validate_init, (depth,)) as pool:
+        yield from pool.imap_unordered(_validate_job, items, VALIDATE_CHUNK)
+
+
+def validate_puzzles_main(args):
+    """--validate-puzzles: JSON-lines report to --report (or stdout),
+    progress and puzzles/second on stderr.  Exit status 1 if any puzzle
+    has errors."""
+    if args.validate_puzzles:
+        items = iter_puzzle_file(args.validate_puzzles)
+    elif args.puzzle_db:
+        items = iter_puzzle_file(args.puzzle_db)
     else:
-        gs.status = 'playing'
+        items = ((k, gm) for k, gm in GAMES.items() if gm['mode'] == 'puzzle')
+    depth = args.engine_depth or VALIDATE_DEPTH
+    out   = open(args.report, 'w') if args.report else sys.stdout
+    n = n_err = n_flag = 0
+    t0 = last = time.perf_counter()
+    try:
+        for report in validate_puzzles(items, depth, args.jobs):
+            out.write(json.dumps(report) + '\n')
+            n      += 1
+            n_err  += not report['ok']
+            n_flag += bool(report['flags'])
+            now = time.perf_counter()
+            if now - last >= 2.0:
+                last = now
+                print(f"{n} puzzles  {n / (now - t0):.1f} puzzles/s", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    secs = time.perf_counter() - t0
+    print(f"{n} puzzles in {secs:.2f}s: {n / (secs or 1e-9):.1f} puzzles/s, "
+          f"{n_err} with errors, {n_flag} flagged (depth {depth})", file=sys.stderr)
+    return 1 if n_err else 0
+
+
+# ---------------------------------------------------------------------------
+# Tactic mining  (--mine-puzzles)
+# Three stages: the main process streams games and replays them into
+# positions, a process pool searches each position, and the main process
+# writes the puzzles it gets back.  A position becomes a puzzle when exactly
+# one move mates, or wins PUZZLE_WIN_CP over its captures-only value.  The
+# checkpoint is advanced after each batch of games; re-mining a batch after
+# a crash only re-writes the same keys.
+# ---------------------------------------------------------------------------
+MINE_DEPTH      = VALIDATE_DEPTH   # so mined puzzles pass --validate-puzzles
+MINE_FROM_PLY   = 8                # opening plies skipped in every game
+MINE_CHECKPOINT = 10               # games between checkpoints
+
+
+def find_tactic(board, turn, ep=None, depth=MINE_DEPTH, engine=None):
+    """Puzzle entry for the position if exactly one move wins, else None.
+    Positions in check or with fewer than two legal moves are skipped."""
+    engine = engine or Engine()
+    us, ep_sq = COLOR_BIT[turn], _ep_sq(ep)
+    if len(_legal_moves(board, us, ep_sq)) < 2:
+        return None
+    if _is_attacked(board.sq, board.sq.index(us | KING), us ^ 8):
+        return None
+    # Null-window scans stopping at the second hit: most positions are
+    # rejected without an exact score.  A lone mate still counts when other
+    # moves merely win material.
+    base  = engine.quiet_value(board, turn, ep)
+    bound = base + PUZZLE_WIN_CP
+    wins  = _winning_moves(engine, board, turn, ep, depth, bound)
+    if len(wins) > 1:
+        bound = MATE_BOUND
+        wins  = _winning_moves(engine, board, turn, ep, depth, bound)
+    if len(wins) != 1:
+        return None
+    move  = wins[0]
+    score = engine.move_values(board, turn, ep, depth, moves=[move])[move]
+    if score < bound:
+        return None
+    mate  = score >= MATE_BOUND
+    fr, to = move[:2]
+    a, b  = rc_to_alg(*_RC[fr]), rc_to_alg(*_RC[to])
+    side  = turn.capitalize()
+    piece = PIECE_TYPES[(board.sq[fr] & 7) - 1]
+    if mate:
+        n     = (MATE_SCORE - score + 1) // 2
+        label = f"Mate in {n}"
+        msg   = f"{piece.capitalize()} {a}-{b}! Forced mate in {n}."
+    else:
+        label = "Win material"
+        msg   = (f"{piece.capitalize()} {a}-{b}! Wins about "
+                 f"{(score - base) / 100:.1f} pawns of material.")
+    return {
+        'label':       label,
+        'mode':        'puzzle',
+        'theme':       'mate' if mate else 'material',
+        'fen':         write_fen(board, turn, ep),
+        'solution':    [(a, b)],
+        'hint_sq':     a,
+        'description': f"{side} to move. {'Find the mate!' if mate else 'Find the winning move!'}",
+        'success_msg': msg,
+        'free_play':   False,
+    }
+
+
+def _winning_moves(engine, board, turn, ep, depth, bound):
+    """Up to two moves scoring >= bound.  Under-promotions are left out:
+    puzzle mode auto-queens, so they could not be played anyway."""
+    ep_sq = _ep_sq(ep)
+    moves = [m for m in engine._ordered(board, _legal_moves(board, COLOR_BIT[turn], ep_sq),
+                                        ep_sq, None, 0) if m[2] in (0, QUEEN)]
+    values = engine.move_values(board, turn, ep, depth, moves, bound, stop_after=2)
+    return [m for m, v in values.items() if v >= bound]
+
+
+def _game_positions(tags, moves):
+    """(ply, fen) for each position of a decoded PGN game from MINE_FROM_PLY on."""
+    if 'FEN' in tags:
+        board, turn, ep, halfmove, fullmove = read_fen(tags['FEN'])
+    else:
+        board, turn, ep, halfmove, fullmove = make_board(), 'white', None, 0, 1
+    us, ep_sq = COLOR_BIT[turn], _ep_sq(ep)
+    out = []
+    for ply in range(len(moves) + 1):
+        if ply >= MINE_FROM_PLY:
+            out.append((ply, write_fen(board, turn, _RC[ep_sq] if ep_sq >= 0 else None,
+                                       halfmove, fullmove)))
+        if ply == len(moves):
+            break
+        m = moves[ply]
+        r, c   = alg_to_rc(m[0])
+        mr, mc = alg_to_rc(m[1])
+        fr, to = r * 8 + c, mr * 8 + mc
+        is_pawn = board.sq[fr] & 7 == PAWN
+        new_ep  = (fr + to) // 2 if is_pawn and abs(to - fr) == 16 else -1
+        undo    = _make(board, fr, to, ep_sq, PIECE_TYPES.index(m[2]) + 1 if len(m) > 2 else 0)
+        halfmove = 0 if is_pawn or undo[4] else halfmove + 1
+        if turn == 'black':
+            fullmove += 1
+        us, ep_sq = us ^ 8, new_ep
+        turn = opponent(turn)
+    return out
+
+
+_miner = None
+
+
+def _mine_init(depth):
+    global _miner
+    _miner = (Engine(), depth)
+
+
+def _mine_job(job):
+    """Search one game's positions.  Returns (game_no, positions, seconds,
+    [(key, entry), ...])."""
+    engine, depth = _miner
+    game_no, source, positions = job
+    engine.clear()
+    t0    = time.perf_counter()
+    found = []
+    for ply, fen in positions:
+        board, turn, ep = parse_fen(fen)
+        entry = find_tactic(board, turn, ep, depth, engine)
+        if entry:
+            entry['source'] = f"{source}#{game_no} ply {ply}"
+            found.append((f"mined-{zobrist_key(board, turn, ep):016x}", entry))
+    return game_no, len(positions), time.perf_counter() - t0, found
+
+
+def mine_puzzles(pgn_path, store, depth=MINE_DEPTH, jobs=None, progress=None):
+    """Mine every game of pgn_path not yet checkpointed in store and add the
+    puzzles found.  progress(stats), if given, is called after each game.
+    Returns the stats dict: games, positions and seconds per stage."""
+    source = os.path.basename(pgn_path)
+    done   = store.checkpoint(source)
+    stats  = {'games': 0, 'skipped': done, 'puzzles': 0, 'read_positions': 0,
+              'read_s': 0.0, 'search_positions': 0, 'search_s': 0.0, 'write_s': 0.0}
+
+    def games():
+        t0 = time.perf_counter()
+        for game_no, tags, moves, _sans, _notes in iter_pgn(pgn_path, strict=False):
+            if game_no <= done:
+                continue
+            positions = _game_positions(tags, moves)
+            stats['read_positions'] += len(positions)
+            stats['read_s']         += time.perf_counter() - t0
+            yield game_no, source, positions
+            t0 = time.perf_counter()
+        stats['read_s'] += time.perf_counter() - t0
+
+    def write(batch, last_game):
+        t0 = time.perf_counter()
+        stats['puzzles'] += store.add_many(batch)
+        store.set_checkpoint(source, last_game)
+        stats['write_s'] += time.perf_counter() - t0
+
+    jobs  = jobs or os.cpu_count() or 1
+    batch = []
+    if jobs == 1:
+        _mine_init(depth)
+        results, pool = map(_mine_job, games()), None
+    else:
+        pool    = multiprocessing.get_context('spawn').Pool(jobs, _mine_init, (depth,))
+        # imap keeps game order, so the checkpoint is always a clean prefix
+        results = pool.imap(_mine_job, games())
+    try:
+        for game_no, n, secs, found in results:
+            stats['games']            += 1
+            stats['search_positions'] += n
+            stats['search_s']         += secs
+            batch.extend(found)
+            if stats['games'] % MINE_CHECKPOINT == 0:
+                write(batch, game_no)
+                batch = []
+            if progress:
+                progress(stats)
+        if stats['games']:
+            write(batch, game_no)
+    finally:
+        if pool:
+            pool.terminate()
+    return stats
+
+
+def mine_puzzles_main(args):
+    """--mine-puzzles: mine a PGN file into --puzzle-db, with progress and a
+    per-stage positions/second summary."""
+    if not args.puzzle_db:
+        print("--mine-puzzles needs --puzzle-db")
+        return 2
+    t0   = time.perf_counter()
+    last = [t0]
+
+    def progress(stats):
+        now = time.perf_counter()
+        if now - last[0] >= 2.0:
+            last[0] = now
+            print(f"{stats['games']} games  {stats['search_positions']} positions  "
+                  f"{stats['search_positions'] / (now - t0):.1f} positions/s  "
+                  f"{stats['puzzles']} puzzles")
+
+    stats = mine_puzzles(args.mine_puzzles, puzzle_store(), args.engine_depth or MINE_DEPTH,
+                         args.jobs, progress)
+    wall  = time.perf_counter() - t0
+    if stats['skipped']:
+        print(f"resumed after game {stats['skipped']}")
+    print(f"read    {stats['read_positions']:>8} positions in {stats['read_s']:7.2f}s  "
+          f"{stats['read_positions'] / (stats['read_s'] or 1e-9):>10.1f} positions/s")
+    print(f"search  {stats['search_positions']:>8} positions in {stats['search_s']:7.2f}s  "
+          f"{stats['search_positions'] / (stats['search_s'] or 1e-9):>10.1f} positions/s "
+          "per process")
+    print(f"write   {stats['puzzles']:>8} puzzles   in {stats['write_s']:7.2f}s")
+    print(f"total   {stats['games']} games, {stats['search_positions']} positions in "
+          f"{wall:.2f}s: {stats['search_positions'] / (wall or 1e-9):.1f} positions/s, "
+          f"{stats['puzzles']} puzzles into {args.puzzle_db}")
+    return 0
 
 
 # ---------------------------------------------------------------------------
 # Fonts
 # ---------------------------------------------------------------------------
+_fonts = {}
+
+
+def get_font(name, size, bold=False):
+    """pygame SysFont, looked up once per (name, size, bold)."""
+    font = _fonts.get((name, size, bold))
+    if font is None:
+        font = _fonts[name, size, bold] = pygame.font.SysFont(name, size, bold=bold)
+    return font
+
+
 def load_fonts():
-    piece_font  = _load_chess_font(62)
-    ui_font     = pygame.font.SysFont('arial', 23, bold=True)
-    small_font  = pygame.font.SysFont('arial', 17)
-    tab_font    = pygame.font.SysFont('arial', 16, bold=True)
-    title_font  = pygame.font.SysFont('georgia', 22, bold=True)
-    return piece_font, ui_font, small_font, tab_font, title_font
+    ui_font     = get_font('arial', 23, bold=True)
+    small_font  = get_font('arial', 17)
+    tab_font    = get_font('arial', 16, bold=True)
+    title_font  = get_font('georgia', 22, bold=True)
+    return ui_font, small_font, tab_font, title_font
+
+
+# ---------------------------------------------------------------------------
+# Piece sprites
+# Each (colour, type) glyph is composited once -- outline at four offsets,
+# fill on top -- into a surface in the display's format, so drawing a piece
+# is one blit.  The atlas is rebuilt only when the square size changes.
+# ---------------------------------------------------------------------------
+PIECE_GLYPH_SCALE = 62 / 80   # glyph size per square pixel
+_OUTLINE_OFFSETS  = ((-2, 0), (2, 0), (0, -2), (0, 2))
+_piece_atlas      = (None, None)   # (square size, {(colour, type): surface})
+
+
+def _piece_sprite(font, sym, fill, outline):
+    # Composited with premultiplied alpha, which layers translucent edges
+    # exactly as blitting each render straight onto the board does; the
+    # sprite is drawn with BLEND_PREMULTIPLIED to match
+    glyph = font.render(sym, True, fill).premul_alpha()
+    edge  = font.render(sym, True, outline).premul_alpha()
+    w, h  = glyph.get_size()
+    spr   = pygame.Surface((w + 4, h + 4), pygame.SRCALPHA)
+    for dx, dy in _OUTLINE_OFFSETS:
+        spr.blit(edge, (2 + dx, 2 + dy), special_flags=pygame.BLEND_PREMULTIPLIED)
+    spr.blit(glyph, (2, 2), special_flags=pygame.BLEND_PREMULTIPLIED)
+    return spr.convert_alpha() if pygame.display.get_surface() else spr
+
+
+def piece_sprites(square=SQUARE_SIZE):
+    """{(colour, type): outlined piece surface} for squares of this size."""
+    global _piece_atlas
+    size, atlas = _piece_atlas
+    if size != square:
+        font  = _load_chess_font(round(square * PIECE_GLYPH_SCALE))
+        atlas = {}
+        for color, fill, outline in (('white', (255, 255, 255), (30, 30, 30)),
+                                     ('black', (10, 10, 10), (220, 220, 220))):
+            for ptype in PIECE_TYPES:
+                atlas[color, ptype] = _piece_sprite(font, SYMBOLS[color][ptype],
+                                                    fill, outline)
+        _piece_atlas = (square, atlas)
+    return atlas
+
+
+# ---------------------------------------------------------------------------
+# Board layer
+# The checkerboard and its rank/file labels for one square size and colour
+# theme, drawn once; each frame starts from a blit of it and composites the
+# square highlights and pieces on top.
+# ---------------------------------------------------------------------------
+_board_layers = {}
+
+
+def board_layer(square=SQUARE_SIZE, light=C_LIGHT, dark=C_DARK):
+    key   = (square, light, dark)
+    layer = _board_layers.get(key)
+    if layer is not None:
+        return layer
+    size  = 8 * square
+    layer = pygame.Surface((size, size))
+    for r in range(8):
+        for c in range(8):
+            layer.fill(light if (r + c) % 2 == 0 else dark,
+                       (c * square, r * square, square, square))
+    small = get_font('arial', 13, bold=True)
+    for i in range(8):
+        tc = dark if i % 2 == 0 else light
+        lbl = small.render(chr(ord('a') + i), True, tc)
+        layer.blit(lbl, (i * square + 4, size - 16))
+        lbl = small.render(str(8 - i), True, tc)
+        layer.blit(lbl, (4, i * square + 4))
+    if pygame.display.get_surface():
+        layer = layer.convert()
+    _board_layers[key] = layer
+    return layer
+
+
+# ---------------------------------------------------------------------------
+# Overlay surfaces
+# Translucent highlights, move markers and popup panels are filled once per
+# (colour, shape, size) and reused; the wrong-move flash is one opaque
+# board-sized surface whose surface alpha is set each frame.  Nothing is
+# allocated per frame.
+# ---------------------------------------------------------------------------
+_overlays = {}
+_flashes  = {}
+
+
+def overlay(color, shape='fill', size=SQUARE_SIZE):
+    """Cached SRCALPHA surface: 'fill' is a tint, 'dot' / 'ring' mark an
+    empty / occupied target square.  size is a side or a (w, h) pair."""
+    key = (color, shape, size)
+    ov  = _overlays.get(key)
+    if ov is None:
+        w, h = size if isinstance(size, tuple) else (size, size)
+        ov   = pygame.Surface((w, h), pygame.SRCALPHA)
+        if shape == 'fill':
+            ov.fill(color)
+        elif shape == 'dot':
+            pygame.draw.circle(ov, color, (w // 2, h // 2), 14)
+        else:
+            pygame.draw.circle(ov, color, (w // 2, h // 2), w // 2 - 4, 6)
+        _overlays[key] = ov
+    return ov
+
+
+def flash_surface(color, alpha, size=BOARD_PX):
+    """The board-sized flash in color at this frame's alpha."""
+    flash = _flashes.get((color, size))
+    if flash is None:
+        flash = _flashes[color, size] = pygame.Surface((size, size))
+        flash.fill(color)
+    flash.set_alpha(alpha)
+    return flash
 
 
 # ---------------------------------------------------------------------------
@@ -712,90 +3544,59 @@ def tab_click(px, py):
 # ---------------------------------------------------------------------------
 # Shared board drawing
 # ---------------------------------------------------------------------------
-def draw_board_and_pieces(surface, board, selected, valid_moves, piece_font,
-                          check_king_pos=None, hint_sq=None,
-                          wrong_flash_alpha=0, correct_sq=None, last_move=None):
-    C_LAST_MOVE = (205, 185, 80, 160)   # golden yellow for replay last-move highlight
-
-    # 1. Squares
-    for r in range(8):
-        for c in range(8):
-            rect  = sq_rect(r, c)
-            color = C_LIGHT if (r + c) % 2 == 0 else C_DARK
-            pygame.draw.rect(surface, color, rect)
-
-            # Last-move highlight (golden yellow) for replay mode
-            if last_move and ((r, c) == last_move[0] or (r, c) == last_move[1]):
-                ov = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE), pygame.SRCALPHA)
-                ov.fill(C_LAST_MOVE)
-                surface.blit(ov, rect.topleft)
-
-            # King-in-check red tint
-            if check_king_pos and (r, c) == check_king_pos:
-                ov = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE), pygame.SRCALPHA)
-                ov.fill(C_CHECK_KING)
-                surface.blit(ov, rect.topleft)
-
-            # Hint highlight (blue)
-            if hint_sq and (r, c) == hint_sq:
-                ov = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE), pygame.SRCALPHA)
-                ov.fill(C_HINT_SQ)
-                surface.blit(ov, rect.topleft)
-
-            # Correct-move highlight (green)
-            if correct_sq and (r, c) == correct_sq:
-                ov = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE), pygame.SRCALPHA)
-                ov.fill(C_CORRECT_SQ)
-                surface.blit(ov, rect.topleft)
-
-    # 2. Selected square
-    if selected:
-        sr, sc = selected
-        ov = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE), pygame.SRCALPHA)
-        ov.fill(C_HIGHLIGHT)
-        surface.blit(ov, sq_rect(sr, sc).topleft)
-
-    # 3. Valid move dots / rings
-    for mr, mc in valid_moves:
-        rect = sq_rect(mr, mc)
-        ov   = pygame.Surface((SQUARE_SIZE, SQUARE_SIZE), pygame.SRCALPHA)
-        if board[mr][mc] is None:
-            pygame.draw.circle(ov, C_MOVE_DOT, (SQUARE_SIZE//2, SQUARE_SIZE//2), 14)
-        else:
-            pygame.draw.circle(ov, C_MOVE_RING, (SQUARE_SIZE//2, SQUARE_SIZE//2),
-                               SQUARE_SIZE//2 - 4, 6)
-        surface.blit(ov, rect.topleft)
-
-    # 4. Wrong-move full-board red flash
-    if wrong_flash_alpha > 0:
-        flash = pygame.Surface((BOARD_PX, BOARD_PX), pygame.SRCALPHA)
-        flash.fill((220, 50, 50, int(wrong_flash_alpha)))
-        surface.blit(flash, (0, BOARD_Y))
-
-    # 5. Pieces
+C_LAST_MOVE = (205, 185, 80, 160)   # golden yellow for replay last-move highlight
+C_FLASH     = (220, 50, 50)
+
+
+def board_cells(board, selected, valid_moves, check_king_pos=None, hint_sq=None,
+                wrong_flash_alpha=0, correct_sq=None, last_move=None):
+    """What each of the 64 squares shows, as (piece (colour, type) or None,
+    tint colours bottom-up, 'dot' / 'ring' / None, flash alpha) per square
+    index.  Equal cells draw identical pixels, which is what lets the
+    renderer skip unchanged squares."""
+    # Tints stack in this order: last move (replay mode), king in check,
+    # hint, correct move, then the selected square
+    tints = {}
+    if last_move:
+        for rc in last_move:
+            tints.setdefault(rc, []).append(C_LAST_MOVE)
+    for rc, color in ((check_king_pos, C_CHECK_KING), (hint_sq, C_HINT_SQ),
+                      (correct_sq, C_CORRECT_SQ), (selected, C_HIGHLIGHT)):
+        if rc:
+            tints.setdefault(rc, []).append(color)
+    targets = set(valid_moves)
+    flash   = int(wrong_flash_alpha) if wrong_flash_alpha > 0 else 0
+    cells   = []
     for r in range(8):
+        row = board[r]
         for c in range(8):
-            p = board[r][c]
-            if p is None:
-                continue
-            rect   = sq_rect(r, c)
-            sym    = p.symbol()
-            oc = (30,30,30)    if p.color == 'white' else (220,220,220)
-            fc = (255,255,255) if p.color == 'white' else (10,10,10)
-            for dx, dy in [(-2,0),(2,0),(0,-2),(0,2)]:
-                s = piece_font.render(sym, True, oc)
-                surface.blit(s, s.get_rect(center=(rect.centerx+dx, rect.centery+dy)))
-            s = piece_font.render(sym, True, fc)
-            surface.blit(s, s.get_rect(center=rect.center))
-
-    # 6. Rank / file labels
-    small = pygame.font.SysFont('arial', 13, bold=True)
-    for i in range(8):
-        tc = C_DARK if i % 2 == 0 else C_LIGHT
-        lbl = small.render(chr(ord('a') + i), True, tc)
-        surface.blit(lbl, (i * SQUARE_SIZE + 4, BOARD_Y + BOARD_PX - 16))
-        lbl = small.render(str(8 - i), True, tc)
-        surface.blit(lbl, (4, BOARD_Y + i * SQUARE_SIZE + 4))
+            p = row[c]
+            marker = None
+            if (r, c) in targets:
+                marker = 'dot' if p is None else 'ring'
+            cells.append((p and (p.color, p.type), tuple(tints.get((r, c), ())),
+                          marker, flash))
+    return cells
+
+
+def draw_cell(surface, sq, cell):
+    """Draw one square from its board_cells() entry, clipped to the square."""
+    r, c  = _RC[sq]
+    rect  = sq_rect(r, c)
+    local = pygame.Rect(c * SQUARE_SIZE, r * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+    piece, tints, marker, flash = cell
+    surface.set_clip(rect)
+    surface.blit(board_layer(), rect, local)
+    for color in tints:
+        surface.blit(overlay(color), rect)
+    if marker:
+        surface.blit(overlay(C_MOVE_DOT if marker == 'dot' else C_MOVE_RING, marker), rect)
+    if flash:
+        surface.blit(flash_surface(C_FLASH, flash), rect, local)
+    if piece:
+        s = piece_sprites()[piece]
+        surface.blit(s, s.get_rect(center=rect.center), special_flags=pygame.BLEND_PREMULTIPLIED)
+    surface.set_clip(None)
 
 
 # ---------------------------------------------------------------------------
@@ -817,17 +3618,23 @@ def draw_play_status(surface, gs, ui_font, small_font):
     elif gs.promotion_pending:
         msg = "Choose promotion piece"
         col = (150, 220, 255)
+    elif gs.engine_job is not None:
+        msg = f"{gs.turn.capitalize()} is thinking\u2026"
+        col = (150, 220, 255)
     else:
         msg = f"{gs.turn.capitalize()}'s Turn"
         col = (200, 230, 200) if gs.turn == 'white' else (160, 180, 220)
 
     s = ui_font.render(msg, True, col)
     surface.blit(s, s.get_rect(centerx=WINDOW_W//2, centery=bar_y + 26))
-    s2 = small_font.render("Press R to restart", True, (110, 110, 110))
+    hint = "Press R to restart"
+    if gs.engine_info:
+        hint += "   |   " + gs.engine_info
+    s2 = small_font.render(hint, True, (110, 110, 110))
     surface.blit(s2, s2.get_rect(centerx=WINDOW_W//2, centery=bar_y + 62))
 
 
-def draw_promotion_popup(surface, gs, piece_font, ui_font):
+def draw_promotion_popup(surface, gs, ui_font):
     if not gs.promotion_pending:
         return
     color = gs.promotion_color
@@ -837,9 +3644,7 @@ def draw_promotion_popup(surface, gs, piece_font, ui_font):
     bx    = (WINDOW_W - bw) // 2
     by    = BOARD_Y + (BOARD_PX - bh) // 2
 
-    panel = pygame.Surface((bw, bh), pygame.SRCALPHA)
-    panel.fill((245, 245, 245, 235))
-    surface.blit(panel, (bx, by))
+    surface.blit(overlay((245, 245, 245, 235), 'fill', (bw, bh)), (bx, by))
     pygame.draw.rect(surface, C_PROMO_BDR, (bx, by, bw, bh), 3, border_radius=8)
 
     title = ui_font.render("Promote pawn to:", True, (40, 40, 40))
@@ -853,14 +3658,8 @@ def draw_promotion_popup(surface, gs, piece_font, ui_font):
         bg = C_PROMO_SEL if btn.collidepoint(mx, my) else C_PROMO_BG
         pygame.draw.rect(surface, bg, btn, border_radius=6)
         pygame.draw.rect(surface, C_PROMO_BDR, btn, 2, border_radius=6)
-        sym = SYMBOLS[color][ptype]
-        oc  = (30,30,30)    if color == 'white' else (210,210,210)
-        fc  = (255,255,255) if color == 'white' else (10,10,10)
-        for dx, dy in [(-2,0),(2,0),(0,-2),(0,2)]:
-            s = piece_font.render(sym, True, oc)
-            surface.blit(s, s.get_rect(center=(btn.centerx+dx, btn.centery+dy)))
-        s = piece_font.render(sym, True, fc)
-        surface.blit(s, s.get_rect(center=btn.center))
+        s = piece_sprites()[color, ptype]
+        surface.blit(s, s.get_rect(center=btn.center), special_flags=pygame.BLEND_PREMULTIPLIED)
 
 
 def get_promotion_rects(gs):
@@ -882,16 +3681,24 @@ def get_promotion_rects(gs):
 # ---------------------------------------------------------------------------
 # Play mode click handler
 # ---------------------------------------------------------------------------
+def finish_promotion(gs, ptype):
+    """Turn the pawn waiting on gs.promotion_pending into ptype and pass the move."""
+    pr, pc = gs.promotion_pending
+    promote_piece(gs.board, pr, pc, ptype)
+    gs.zobrist = zobrist_promote(gs.zobrist, gs.promotion_color, (pr, pc), ptype)
+    gs.promotion_pending  = None
+    gs.promotion_color    = None
+    gs.turn = opponent(gs.turn)
+    _update_status(gs)
+
+
 def handle_play_click(gs, px, py):
+    if gs.turn in gs.engine_colors:
+        return
     if gs.promotion_pending:
         for rect, ptype in get_promotion_rects(gs):
             if rect.collidepoint(px, py):
-                pr, pc = gs.promotion_pending
-                gs.board[pr][pc].type = ptype
-                gs.promotion_pending  = None
-                gs.promotion_color    = None
-                gs.turn = opponent(gs.turn)
-                _update_status(gs)
+                finish_promotion(gs, ptype)
                 break
         return
     sq = pixel_to_sq(px, py)
@@ -902,7 +3709,7 @@ def handle_play_click(gs, px, py):
     if gs.selected is None:
         if piece and piece.color == gs.turn:
             gs.selected    = (r, c)
-            gs.valid_moves = legal_moves(gs.board, r, c, gs.en_passant_target)
+            gs.valid_moves = gs.move_map.get((r, c), [])
     else:
         sr, sc = gs.selected
         if (r, c) in gs.valid_moves:
@@ -910,11 +3717,102 @@ def handle_play_click(gs, px, py):
             gs.selected = None; gs.valid_moves = []
         elif piece and piece.color == gs.turn:
             gs.selected    = (r, c)
-            gs.valid_moves = legal_moves(gs.board, r, c, gs.en_passant_target)
+            gs.valid_moves = gs.move_map.get((r, c), [])
         else:
             gs.selected = None; gs.valid_moves = []
 
 
+# ---------------------------------------------------------------------------
+# Play mode -- engine moves
+# ---------------------------------------------------------------------------
+def engine_to_move(gs):
+    return (gs.turn in gs.engine_colors and gs.status in ('playing', 'check')
+            and not gs.promotion_pending)
+
+
+def play_engine_move(gs, result):
+    """Apply a search result to gs and record its depth / speed for the status bar."""
+    (r, c), (mr, mc), promo = result['move']
+    apply_move(gs, r, c, mr, mc)
+    if gs.promotion_pending:
+        finish_promotion(gs, promo or 'queen')
+    gs.selected, gs.valid_moves = None, []
+    gs.engine_info = (f"engine: depth {result['depth']}, {result['nodes']:,} nodes, "
+                      f"{result['nps']:,} nps")
+
+
+def _start_search(gs, worker):
+    """Engine to move: take over a ponder job that guessed the human's move,
+    else drop it and search from scratch."""
+    if gs.ponder:
+        job_id, (frm, to, promo), started = gs.ponder
+        gs.ponder = None
+        placed = gs.board[to[0]][to[1]]
+        if (gs.last_move == (frm, to) and worker.pending == job_id
+                and (promo is None or placed.type == promo)):
+            # Ponder hit: the search has been running on this very position
+            # since started, so the move time counts from then.  A search
+            # that already used it is stopped on the next tick.
+            gs.engine_job = job_id
+            if gs.engine_movetime or not gs.engine_depth:
+                budget = gs.engine_movetime or ENGINE_MOVETIME
+                gs.engine_stop_at = max(time.perf_counter(), started + budget)
+            return
+        worker.cancel(job_id)
+    gs.engine_job = worker.submit(gs.board, gs.turn, gs.en_passant_target,
+                                  gs.engine_depth, gs.engine_movetime)
+
+
+def _start_ponder(gs, worker, pv):
+    """Human to move: search the position after the reply the engine expects
+    (the second move of its PV) until the human moves."""
+    if len(pv) < 2 or gs.status not in ('playing', 'check'):
+        return
+    frm, to, promo = uci_to_move(pv[1])
+    if to not in gs.move_map.get(frm, []):
+        return
+    board  = copy_board(gs.board)
+    moving = board[frm[0]][frm[1]]
+    new_ep = ((frm[0] + to[0]) // 2, frm[1]) \
+             if moving.type == 'pawn' and abs(to[0] - frm[0]) == 2 else None
+    make_move(board, (frm, to), gs.en_passant_target, promo)
+    # Capped so a long think does not keep a core busy: a fixed depth is its
+    # own cap, otherwise the search stops after ENGINE_PONDER_TIME
+    movetime = None
+    if gs.engine_movetime or not gs.engine_depth:
+        movetime = max(ENGINE_PONDER_TIME, gs.engine_movetime or ENGINE_MOVETIME)
+    job_id = worker.submit(board, opponent(gs.turn), new_ep, gs.engine_depth, movetime)
+    gs.ponder = (job_id, (frm, to, promo), time.perf_counter())
+
+
+def tick_engine(gs, worker):
+    """Once per frame: start a search when the engine is to move, or play
+    the finished one (then ponder on the human's expected reply).  Never
+    blocks."""
+    if gs.engine_job is None:
+        if engine_to_move(gs):
+            _start_search(gs, worker)
+        return
+    if gs.engine_stop_at is not None and time.perf_counter() >= gs.engine_stop_at:
+        worker.stop(gs.engine_job)
+        gs.engine_stop_at = None
+    result = worker.poll(gs.engine_job)
+    if result is not None:
+        gs.engine_job = gs.engine_stop_at = None
+        if result['move']:
+            play_engine_move(gs, result)
+            if not engine_to_move(gs):
+                _start_ponder(gs, worker, result['pv'])
+    elif worker.pending != gs.engine_job:
+        gs.engine_job = gs.engine_stop_at = None   # lost with its process; resubmitted next tick
+
+
+def cancel_engine(gs, worker):
+    if gs.engine_job is not None or gs.ponder:
+        worker.cancel()
+    gs.engine_job = gs.engine_stop_at = gs.ponder = None
+
+
 # ---------------------------------------------------------------------------
 # Puzzle selector screen
 # ---------------------------------------------------------------------------
@@ -923,25 +3821,28 @@ def handle_play_click(gs, px, py):
 # ---------------------------------------------------------------------------
 ARROW_W = 44
 ARROW_H = 28
-GAME_KEYS = list(GAMES.keys())   # ['game1', 'game2']
 
 
 def get_arrow_rects(state):
     """Return list of (rect, target_game_key, direction) for visible arrows.
     Works for both PuzzleState and ReplayState."""
-    bar_y   = BOARD_Y + BOARD_PX
-    btn_y   = bar_y + STATUS_H - ARROW_H - 8
-    idx     = GAME_KEYS.index(state.game_key)
-    arrows  = []
-    if idx > 0:
-        arrows.append((pygame.Rect(10, btn_y, ARROW_W, ARROW_H),
-                       GAME_KEYS[idx - 1], 'left'))
-    if idx < len(GAME_KEYS) - 1:
-        arrows.append((pygame.Rect(WINDOW_W - ARROW_W - 10, btn_y, ARROW_W, ARROW_H),
-                       GAME_KEYS[idx + 1], 'right'))
+    left, right = _arrow_slots()
+    prev, nxt   = puzzle_store().neighbours(state.game_key)
+    arrows      = []
+    if prev:
+        arrows.append((left, prev, 'left'))
+    if nxt:
+        arrows.append((right, nxt, 'right'))
     return arrows
 
 
+def _arrow_slots():
+    """(left, right) game-nav arrow rects, whether or not the arrows show."""
+    btn_y = BOARD_Y + BOARD_PX + STATUS_H - ARROW_H - 8
+    return (pygame.Rect(10, btn_y, ARROW_W, ARROW_H),
+            pygame.Rect(WINDOW_W - ARROW_W - 10, btn_y, ARROW_W, ARROW_H))
+
+
 def get_replay_step_arrow_rects(rs):
     """Return (prev_rect, next_rect) for stepping through replay moves.
     These are INNER arrows inside the status bar, distinct from game-navigation arrows."""
@@ -1004,7 +3905,7 @@ def draw_replay_status(surface, rs, ui_font, small_font):
     bar_y = BOARD_Y + BOARD_PX
     pygame.draw.rect(surface, C_STATUS_BG, (0, bar_y, WINDOW_W, STATUS_H))
 
-    gm = GAMES[rs.game_key]
+    gm = get_game(rs.game_key)
 
     # --- Title line ---
     if rs.step == 0:
@@ -1012,10 +3913,11 @@ def draw_replay_status(surface, rs, ui_font, small_font):
         title_col = (220, 175, 60)
     else:
         # Which move number and whose turn label
-        move_num  = (rs.step + 1) // 2
-        side      = "White" if rs.step % 2 == 1 else "Black"
+        ply       = rs.ply
+        move_num  = (ply + 1) // 2
+        side      = "White" if ply % 2 == 1 else "Black"
         title_msg = gm['label'] + "  --  Move " + str(move_num) + " (" + side + ")"
-        title_col = (200, 230, 200) if rs.step % 2 == 1 else (160, 180, 220)
+        title_col = (200, 230, 200) if ply % 2 == 1 else (160, 180, 220)
 
     s = ui_font.render(title_msg, True, title_col)
     surface.blit(s, s.get_rect(centerx=WINDOW_W // 2, centery=bar_y + 16))
@@ -1074,9 +3976,9 @@ def draw_nav_popup(surface, state, ui_font, small_font):
     # Works for PuzzleState (has .status) and ReplayState (check is_finished)
     is_ps    = isinstance(state, PuzzleState)
     solved   = (state.status == 'solved') if is_ps else state.is_finished
-    cur_lbl  = GAMES[state.game_key]['label']
+    cur_lbl  = get_game(state.game_key)['label']
     dest_key = state.nav_pending_key
-    dest_lbl = GAMES[dest_key]['label'] if dest_key else ''
+    dest_lbl = get_game(dest_key)['label'] if dest_key else ''
 
     # Panel dimensions
     pw, ph = 420, 160
@@ -1084,9 +3986,7 @@ def draw_nav_popup(surface, state, ui_font, small_font):
     py_    = BOARD_Y + (BOARD_PX - ph) // 2
 
     # Background panel
-    panel = pygame.Surface((pw, ph), pygame.SRCALPHA)
-    panel.fill((30, 32, 44, 240))
-    surface.blit(panel, (px_, py_))
+    surface.blit(overlay((30, 32, 44, 240), 'fill', (pw, ph)), (px_, py_))
     pygame.draw.rect(surface, (100, 120, 200), (px_, py_, pw, ph), 2, border_radius=12)
 
     if solved:
@@ -1136,6 +4036,13 @@ def _nav_popup_btn_rects(px_, py_, pw, ph):
     return stay_r, confirm_r
 
 
+def _nav_popup_buttons():
+    pw, ph = 420, 160
+    px_    = (WINDOW_W - pw) // 2
+    py_    = BOARD_Y + (BOARD_PX - ph) // 2
+    return _nav_popup_btn_rects(px_, py_, pw, ph)
+
+
 def get_nav_popup_click(ps, px, py):
     """
     Returns 'stay', 'confirm', or None depending on what was clicked in the popup.
@@ -1143,10 +4050,7 @@ def get_nav_popup_click(ps, px, py):
     """
     if not ps.show_nav_popup or ps.status == 'solved':
         return None
-    pw, ph = 420, 160
-    px_    = (WINDOW_W - pw) // 2
-    py_    = BOARD_Y + (BOARD_PX - ph) // 2
-    stay_r, confirm_r = _nav_popup_btn_rects(px_, py_, pw, ph)
+    stay_r, confirm_r = _nav_popup_buttons()
     if stay_r.collidepoint(px, py):
         return 'stay'
     if confirm_r.collidepoint(px, py):
@@ -1159,28 +4063,27 @@ def get_nav_popup_click(ps, px, py):
 # ---------------------------------------------------------------------------
 def _apply_puzzle_move(ps, r, c, mr, mc):
     """Apply a move on the puzzle board (no promotion UI, auto-queen)."""
-    board  = ps.board
-    piece  = board[r][c]
+    piece  = ps.board[r][c]
     new_ep = None
-
-    if piece.type == 'pawn' and ps.en_passant_target and (mr, mc) == ps.en_passant_target:
-        board[r][mc] = None
     if piece.type == 'pawn' and abs(mr - r) == 2:
         new_ep = ((r + mr) // 2, c)
 
-    board[mr][mc]   = piece
-    board[r][c]     = None
-    piece.has_moved = True
-
     # Auto-promote to queen
-    promote_row = 0 if piece.color == 'white' else 7
-    if piece.type == 'pawn' and mr == promote_row:
-        piece.type = 'queen'
+    undo   = make_move(ps.board, ((r, c), (mr, mc)), ps.en_passant_target, promotion='queen')
+    ps.zobrist = zobrist_step(ps.zobrist, undo, ps.en_passant_target, new_ep,
+                              ps.board.castling)
 
     ps.en_passant_target = new_ep
     ps.turn = opponent(ps.turn)
 
 
+def _update_puzzle_status(ps):
+    """Status and move map after a puzzle move; mating the opponent solves it."""
+    status, ps.move_map = position_status(ps.board, ps.turn, ps.en_passant_target,
+                                          ps.zobrist)
+    ps.status = 'solved' if status == 'checkmate' else status
+
+
 def _puzzle_validate_and_move(ps, r, c, mr, mc):
     """Make a move in puzzle mode. Validates solution for game1; free play for game2."""
     pz   = ps.puzzle
@@ -1191,16 +4094,7 @@ def _puzzle_validate_and_move(ps, r, c, mr, mc):
         _apply_puzzle_move(ps, r, c, mr, mc)
         ps.selected    = None
         ps.valid_moves = []
-        chk   = is_in_check(ps.board, ps.turn)
-        has_m = bool(all_legal_moves(ps.board, ps.turn, ps.en_passant_target))
-        if chk and not has_m:
-            ps.status = 'solved'
-        elif not chk and not has_m:
-            ps.status = 'stalemate'
-        elif chk:
-            ps.status = 'check'
-        else:
-            ps.status = 'playing'
+        _update_puzzle_status(ps)
         return
 
     # Solution-validated game: check correctness BEFORE applying
@@ -1213,24 +4107,16 @@ def _puzzle_validate_and_move(ps, r, c, mr, mc):
     ps.valid_moves = []
 
     if correct:
-        ps.correct_timer = FPS
+        ps.correct_until = time.perf_counter() + CORRECT_SECONDS
         ps.move_step    += 1
         if ps.move_step >= len(pz['solution']):
-            ps.status = 'solved'
+            ps.status   = 'solved'
+            ps.move_map = {}
         else:
-            chk   = is_in_check(ps.board, ps.turn)
-            has_m = bool(all_legal_moves(ps.board, ps.turn, ps.en_passant_target))
-            if chk and not has_m:
-                ps.status = 'solved'
-            elif not chk and not has_m:
-                ps.status = 'stalemate'
-            elif chk:
-                ps.status = 'check'
-            else:
-                ps.status = 'playing'
+            _update_puzzle_status(ps)
     else:
         ps.status      = 'wrong'
-        ps.flash_timer = FPS * 2       # 2-second red flash then auto-reset
+        ps.flash_until = time.perf_counter() + FLASH_SECONDS   # red flash, then reset
 
 
 # ---------------------------------------------------------------------------
@@ -1248,14 +4134,14 @@ def handle_puzzle_click(ps, px, py):
     if ps.selected is None:
         if piece and piece.color == ps.turn:
             ps.selected    = (r, c)
-            ps.valid_moves = legal_moves(ps.board, r, c, ps.en_passant_target)
+            ps.valid_moves = ps.move_map.get((r, c), [])
     else:
         sr, sc = ps.selected
         if (r, c) in ps.valid_moves:
             _puzzle_validate_and_move(ps, sr, sc, r, c)
         elif piece and piece.color == ps.turn:
             ps.selected    = (r, c)
-            ps.valid_moves = legal_moves(ps.board, r, c, ps.en_passant_target)
+            ps.valid_moves = ps.move_map.get((r, c), [])
         else:
             ps.selected = None; ps.valid_moves = []
 
@@ -1270,7 +4156,7 @@ def _make_replay_state(game_key):
     return ReplayState(game_key)
 
 def _make_state(game_key):
-    if GAMES[game_key]['mode'] == 'replay':
+    if get_game(game_key)['mode'] == 'replay':
         return _make_replay_state(game_key)
     return _make_puzzle_state(game_key)
 
@@ -1285,7 +4171,7 @@ def _handle_nav_arrow_click(state, dest_key):
     state.nav_pending_key = dest_key
     state.show_nav_popup  = True
     if finished:
-        state.nav_popup_timer = int(FPS * 1.5)
+        state.nav_popup_until = time.perf_counter() + NAV_POPUP_SECONDS
 
 def _handle_nav_popup_action(state, action):
     """Returns new state object or same state depending on action."""
@@ -1300,55 +4186,215 @@ def _handle_nav_popup_action(state, action):
         return new_state
     return state
 
-def _tick_nav_popup(state):
+def _tick_nav_popup(state, now):
     """Auto-dismiss popup for finished games. Returns (possibly new) state."""
     is_ps    = isinstance(state, PuzzleState)
     finished = (state.status == 'solved') if is_ps else state.is_finished
-    if state.show_nav_popup and finished and state.nav_popup_timer > 0:
-        state.nav_popup_timer = max(0, state.nav_popup_timer - 1)
-        if state.nav_popup_timer == 0:
-            dest = state.nav_pending_key
-            state.reset()
-            return _make_state(dest)
+    if (state.show_nav_popup and finished and state.nav_popup_until is not None
+            and now >= state.nav_popup_until):
+        dest = state.nav_pending_key
+        state.reset()
+        return _make_state(dest)
     return state
 
 
+def _tick_puzzle_timers(ps, now):
+    """Expire the hint and correct-move highlights; reset after the
+    wrong-move flash."""
+    if ps.hint_until is not None and now >= ps.hint_until:
+        ps.hint_until = None
+    if ps.correct_until is not None and now >= ps.correct_until:
+        ps.correct_until = None
+    if ps.status == 'wrong' and ps.flash_until is not None and now >= ps.flash_until:
+        ps.reset()
+
+
+def _shift_timers(state, delta):
+    """Push state's running deadlines delta seconds later: the puzzle tab
+    was hidden that long, and its timers only run while it is shown."""
+    for name in ('hint_until', 'flash_until', 'correct_until', 'nav_popup_until'):
+        until = getattr(state, name, None)
+        if until is not None:
+            setattr(state, name, until + delta)
+
+
+def _idle_wait(app_mode, gs, state, now):
+    """How long the main loop may block waiting for input: 0 while the
+    wrong-move flash animates or an engine search needs polling, else
+    until the next timer deadline, at most IDLE_WAIT."""
+    if app_mode == 'play':
+        return 0 if gs.engine_job is not None or engine_to_move(gs) else IDLE_WAIT
+    deadlines = [state.nav_popup_until]
+    if isinstance(state, PuzzleState):
+        if state.status == 'wrong' and state.flash_until is not None:
+            return 0
+        deadlines += [state.hint_until, state.correct_until]
+    return max(0, min([IDLE_WAIT] + [d - now for d in deadlines if d is not None]))
+
+
+# ---------------------------------------------------------------------------
+# Dirty-rectangle rendering
+# Each frame is reduced to keys -- one per board square, one each for the
+# tab bar, the status bar and any popup -- and only the regions whose key
+# changed since the last frame are redrawn and passed to
+# pygame.display.update().  A frame in which nothing changed draws nothing.
+# ---------------------------------------------------------------------------
+TABS_RECT   = pygame.Rect(0, 0, WINDOW_W, TAB_H)
+BOARD_RECT  = pygame.Rect(0, BOARD_Y, BOARD_PX, BOARD_PX)
+STATUS_RECT = pygame.Rect(0, BOARD_Y + BOARD_PX, WINDOW_W, STATUS_H)
+
+
+def _hovered(rects):
+    """Index of the rect under the mouse, -1 for none."""
+    pos = pygame.mouse.get_pos()
+    for i, rect in enumerate(rects):
+        if rect.collidepoint(pos):
+            return i
+    return -1
+
+
+def _scene(app_mode, gs, state, now):
+    """(board cells, status key, popup key or None) for this frame."""
+    if app_mode == 'play':
+        chk_pos = find_king(gs.board, gs.turn) if gs.status == 'check' else None
+        cells   = board_cells(gs.board, gs.selected, gs.valid_moves, check_king_pos=chk_pos)
+        status  = ('play', gs.status, gs.turn, bool(gs.promotion_pending),
+                   gs.engine_job is None, gs.engine_info)
+        popup   = None
+        if gs.promotion_pending:
+            popup = ('promo', gs.promotion_color,
+                     _hovered([rect for rect, _ptype in get_promotion_rects(gs)]))
+        return cells, status, popup
+
+    if isinstance(state, ReplayState):
+        cells  = board_cells(state.board, None, [], last_move=state.last_move)
+        status = ('replay', state.game_key, state.step,
+                  _hovered(get_replay_step_arrow_rects(state) + _arrow_slots()))
+        done   = state.is_finished
+    else:
+        pz      = state.puzzle
+        chk_pos = find_king(state.board, state.turn) if state.status == 'check' else None
+        hint_rc = alg_to_rc(pz['hint_sq']) if state.hint_until is not None else None
+        wrong_alpha = 0
+        if state.status == 'wrong' and state.flash_until is not None:
+            wrong_alpha = int(110 * max(0.0, state.flash_until - now) / FLASH_SECONDS)
+        correct_rc = None
+        if not pz['free_play'] and state.correct_until is not None and state.move_step > 0:
+            correct_rc = alg_to_rc(pz['solution'][state.move_step - 1][1])
+        cells  = board_cells(state.board, state.selected, state.valid_moves,
+                             check_king_pos=chk_pos, hint_sq=hint_rc,
+                             wrong_flash_alpha=wrong_alpha, correct_sq=correct_rc)
+        status = ('puzzle', state.game_key, state.status, state.turn,
+                  _hovered(_arrow_slots()))
+        done   = state.status == 'solved'
+    popup = None
+    if state.show_nav_popup:
+        popup = ('nav', state.game_key, state.nav_pending_key, done,
+                 -1 if done else _hovered(_nav_popup_buttons()))
+    return cells, status, popup
+
+
+class DirtyRenderer:
+    """What each screen region showed last frame, to redraw only changes."""
+    __slots__ = ('cells', 'tabs', 'status', 'popup')
+
+    def __init__(self):
+        self.invalidate()
+
+    def invalidate(self):
+        """Redraw everything next frame (first frame, window exposed)."""
+        self.cells  = [None] * 64
+        self.tabs   = self.status = self.popup = None
+
+    def render(self, screen, app_mode, gs, state, fonts, now):
+        """Draw what changed; returns the rects to pass to display.update()."""
+        ui_font, small_font, tab_font, title_font = fonts
+        cells, status, popup = _scene(app_mode, gs, state, now)
+        if popup != self.popup or (popup and cells != self.cells):
+            self.cells = [None] * 64   # the popup sits over the board
+        dirty = []
+        for sq, cell in enumerate(cells):
+            if cell != self.cells[sq]:
+                draw_cell(screen, sq, cell)
+                dirty.append(sq_rect(*_RC[sq]))
+        if len(dirty) > 16:
+            dirty = [BOARD_RECT]
+        if popup and dirty:
+            if app_mode == 'play':
+                draw_promotion_popup(screen, gs, ui_font)
+            else:
+                draw_nav_popup(screen, state, ui_font, small_font)
+        if status != self.status:
+            if app_mode == 'play':
+                draw_play_status(screen, gs, ui_font, small_font)
+            elif isinstance(state, ReplayState):
+                draw_replay_status(screen, state, ui_font, small_font)
+            else:
+                draw_puzzle_status(screen, state, ui_font, small_font)
+            dirty.append(STATUS_RECT)
+        if app_mode != self.tabs:
+            draw_tabs(screen, app_mode, tab_font, title_font)
+            dirty.append(TABS_RECT)
+        self.cells, self.status, self.popup, self.tabs = cells, status, popup, app_mode
+        return dirty
+
+
 # ---------------------------------------------------------------------------
 # Main loop
 # ---------------------------------------------------------------------------
-def main():
+def main(start_key=None, engine_colors=(), engine_depth=None, engine_movetime=None,
+         threads=1, tt_size=ENGINE_TT_SIZE):
     pygame.init()
     screen = pygame.display.set_mode((WINDOW_W, WINDOW_H))
     pygame.display.set_caption("Chess  --  The Brain Games Academy")
     clock = pygame.time.Clock()
 
-    piece_font, ui_font, small_font, tab_font, title_font = load_fonts()
+    fonts    = load_fonts()
+    renderer = DirtyRenderer()
 
     app_mode = 'play'
-    gs       = GameState()
+    gs       = GameState(engine_colors, engine_depth, engine_movetime)
+    worker   = EngineWorker(threads, tt_size=tt_size)
+    if engine_colors:
+        worker.start()
     # Active puzzle/replay state — can be PuzzleState or ReplayState
-    cur_state = _make_state('game1')
+    cur_state = _make_state(start_key or puzzle_store().first_key())
 
-    running = True
+    running   = True
+    wait      = 0                    # draw the first frame straight away
+    hidden_at = time.perf_counter()  # when the puzzle tab was last left
     while running:
-        clock.tick(FPS)
+        # Fixed-rate ticks only while something animates or the engine is
+        # searching; otherwise sleep in the event queue until input arrives
+        # or the next timer is due
+        if wait:
+            event  = pygame.event.wait(max(1, int(wait * 1000)))
+            events = [] if event.type == pygame.NOEVENT else [event] + pygame.event.get()
+        else:
+            clock.tick(FPS)
+            events = pygame.event.get()
 
         # ---- Events -------------------------------------------------------
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
 
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                renderer.invalidate()
+
             elif event.type == pygame.KEYDOWN:
                 if app_mode == 'play':
                     if event.key == pygame.K_r:
-                        gs = GameState()
+                        cancel_engine(gs, worker)
+                        worker.clear()
+                        gs.reset()
                 elif app_mode == 'puzzle':
                     if not cur_state.show_nav_popup:
                         if isinstance(cur_state, PuzzleState):
                             if event.key == pygame.K_r:
                                 cur_state.reset()
                             elif event.key == pygame.K_h and cur_state.status not in ('solved',):
-                                cur_state.hint_timer = FPS * 3
+                                cur_state.hint_until = time.perf_counter() + HINT_SECONDS
                         elif isinstance(cur_state, ReplayState):
                             if event.key == pygame.K_LEFT and cur_state.step > 0:
                                 cur_state.step -= 1
@@ -1361,6 +4407,12 @@ def main():
                 # Main tab bar click
                 mode = tab_click(px, py)
                 if mode:
+                    if mode != app_mode:
+                        cancel_engine(gs, worker)
+                        if app_mode == 'puzzle':
+                            hidden_at = time.perf_counter()
+                        elif mode == 'puzzle':
+                            _shift_timers(cur_state, time.perf_counter() - hidden_at)
                     app_mode = mode
 
                 elif app_mode == 'play':
@@ -1400,67 +4452,125 @@ def main():
                             handle_puzzle_click(cur_state, px, py)
 
         # ---- Timers -------------------------------------------------------
+        now = time.perf_counter()
         if app_mode == 'puzzle':
             if isinstance(cur_state, PuzzleState):
-                if cur_state.hint_timer > 0:
-                    cur_state.hint_timer = max(0, cur_state.hint_timer - 1)
-                if cur_state.correct_timer > 0:
-                    cur_state.correct_timer = max(0, cur_state.correct_timer - 1)
-                if cur_state.status == 'wrong' and cur_state.flash_timer > 0:
-                    cur_state.flash_timer = max(0, cur_state.flash_timer - 1)
-                    if cur_state.flash_timer == 0:
-                        cur_state.reset()
-            cur_state = _tick_nav_popup(cur_state)
+                _tick_puzzle_timers(cur_state, now)
+            cur_state = _tick_nav_popup(cur_state, now)
 
         # ---- Draw ---------------------------------------------------------
-        screen.fill(C_BG)
+        dirty = renderer.render(screen, app_mode, gs, cur_state, fonts, now)
+        if dirty:
+            pygame.display.update(dirty)
 
         if app_mode == 'play':
-            chk_pos = find_king(gs.board, gs.turn) if gs.status == 'check' else None
-            draw_board_and_pieces(
-                screen, gs.board, gs.selected, gs.valid_moves, piece_font,
-                check_king_pos=chk_pos)
-            draw_play_status(screen, gs, ui_font, small_font)
-            if gs.promotion_pending:
-                draw_promotion_popup(screen, gs, piece_font, ui_font)
-
-        elif app_mode == 'puzzle':
-            if isinstance(cur_state, ReplayState):
-                draw_board_and_pieces(
-                    screen, cur_state.board, None, [], piece_font,
-                    last_move=cur_state.last_move)
-                draw_replay_status(screen, cur_state, ui_font, small_font)
-                if cur_state.show_nav_popup:
-                    draw_nav_popup(screen, cur_state, ui_font, small_font)
-
-            elif isinstance(cur_state, PuzzleState):
-                pz      = cur_state.puzzle
-                chk_pos = find_king(cur_state.board, cur_state.turn) \
-                          if cur_state.status == 'check' else None
-                hint_rc = alg_to_rc(pz['hint_sq']) if cur_state.hint_timer > 0 else None
-                wrong_alpha = 0
-                if cur_state.status == 'wrong' and cur_state.flash_timer > 0:
-                    wrong_alpha = int(110 * cur_state.flash_timer / (FPS * 2))
-                correct_rc = None
-                if not pz['free_play'] and cur_state.correct_timer > 0 and cur_state.move_step > 0:
-                    correct_rc = alg_to_rc(pz['solution'][cur_state.move_step - 1][1])
-                draw_board_and_pieces(
-                    screen, cur_state.board, cur_state.selected,
-                    cur_state.valid_moves, piece_font,
-                    check_king_pos=chk_pos,
-                    hint_sq=hint_rc,
-                    wrong_flash_alpha=wrong_alpha,
-                    correct_sq=correct_rc)
-                draw_puzzle_status(screen, cur_state, ui_font, small_font)
-                if cur_state.show_nav_popup:
-                    draw_nav_popup(screen, cur_state, ui_font, small_font)
-
-        draw_tabs(screen, app_mode, tab_font, title_font)
-        pygame.display.flip()
+            tick_engine(gs, worker)
+        wait = _idle_wait(app_mode, gs, cur_state, time.perf_counter())
 
+    worker.close()
     pygame.quit()
     sys.exit()
 
 
+# ---------------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------------
+def _parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Chess  --  The Brain Games Academy")
+    ap.add_argument('--perft', type=int, metavar='DEPTH',
+                    help="count move-tree nodes instead of opening the window")
+    ap.add_argument('--fen', help="position for --perft (default: standard suite)")
+    ap.add_argument('--divide', action='store_true',
+                    help="print the node count under every root move")
+    ap.add_argument('--bitboard', action='store_true',
+                    help="run perft on the bitboard Position core")
+    ap.add_argument('--baseline', default=PERFT_BASELINE, metavar='FILE',
+                    help="JSON baseline to compare against (default: %(default)s)")
+    ap.add_argument('--save-baseline', action='store_true',
+                    help="store this run's results in the baseline file")
+    ap.add_argument('--bench-movegen', action='store_true',
+                    help="time raw_moves() per piece type against the reference")
+    ap.add_argument('--puzzle-db', metavar='FILE',
+                    help="SQLite puzzle store to play from (seeded from the "
+                         "built-in games when new)")
+    ap.add_argument('--import-games', action='store_true',
+                    help="copy the built-in games into --puzzle-db and exit")
+    ap.add_argument('--pgn', metavar='FILE',
+                    help="import every game in a PGN file as a replay and open the first")
+    ap.add_argument('--bench-pgn', metavar='FILE',
+                    help="decode a PGN file and report games/second")
+    ap.add_argument('--engine', choices=('white', 'black', 'both'),
+                    help="let the computer play this colour in Play mode")
+    ap.add_argument('--engine-depth', type=int, metavar='N',
+                    help="engine search depth limit (default: time limited; "
+                         f"{VALIDATE_DEPTH} for --validate-puzzles and --mine-puzzles)")
+    ap.add_argument('--engine-time', type=float, metavar='SECONDS',
+                    help=f"engine time per move (default: {ENGINE_MOVETIME}s "
+                         "unless --engine-depth is given)")
+    ap.add_argument('--tt-size', type=int, default=ENGINE_TT_SIZE, metavar='ENTRIES',
+                    help="transposition table entries for the engine process, about "
+                         f"250 bytes each (default: {ENGINE_TT_SIZE})")
+    ap.add_argument('--bench-engine', action='store_true',
+                    help="search a fixed position set and report depth and nodes/second")
+    ap.add_argument('--threads', type=int, default=1, metavar='N',
+                    help="search processes sharing one transposition table (default: 1; "
+                         "more only pays off with that many idle cores, see --bench-smp)")
+    ap.add_argument('--bench-smp', action='store_true',
+                    help="time-to-depth on the engine bench, 1 vs --threads processes")
+    ap.add_argument('--validate-puzzles', nargs='?', const='', metavar='FILE',
+                    help="check every puzzle in an SQLite store or EPD pack (default: "
+                         "--puzzle-db or the built-in games) and write a JSON-lines report")
+    ap.add_argument('--report', metavar='FILE',
+                    help="where --validate-puzzles writes its report (default: stdout)")
+    ap.add_argument('--mine-puzzles', metavar='PGN',
+                    help="search every position of a PGN file for one-move-wins tactics "
+                         "and add them to --puzzle-db (resumes where it stopped)")
+    ap.add_argument('--jobs', type=int, metavar='N',
+                    help="processes for --validate-puzzles / --mine-puzzles "
+                         "(default: one per CPU)")
+    return ap.parse_args(argv)
+
+
+def cli(argv=None):
+    args = _parse_args(argv)
+    if args.puzzle_db:
+        store = open_puzzle_store(args.puzzle_db)
+        if args.import_games:
+            n = store.import_games(GAMES)
+            print(f"imported {n} games into {args.puzzle_db} ({len(store)} entries)")
+            return 0
+    elif args.import_games:
+        print("--import-games needs --puzzle-db")
+        return 2
+    if args.perft is not None:
+        return perft_main(args)
+    if args.bench_movegen:
+        return bench_movegen_main(args)
+    if args.bench_pgn:
+        return bench_pgn_main(args)
+    if args.bench_engine:
+        return bench_engine_main(args)
+    if args.bench_smp:
+        return bench_smp_main(args)
+    if args.validate_puzzles is not None:
+        return validate_puzzles_main(args)
+    if args.mine_puzzles:
+        return mine_puzzles_main(args)
+    start_key = None
+    if args.pgn:
+        entries = iter_pgn_entries(args.pgn, strict=False)
+        first   = next(entries, None)
+        if first is None:
+            print(f"no readable games in {args.pgn}")
+            return 1
+        n = puzzle_store().add_many([first]) + puzzle_store().add_many(entries)
+        print(f"imported {n} games from {args.pgn}")
+        start_key = first[0]
+    colors = {'white': ('white',), 'black': ('black',),
+              'both': ('white', 'black')}.get(args.engine, ())
+    main(start_key, colors, args.engine_depth, args.engine_time, args.threads, args.tt_size)
+
+
 if __name__ == '__main__':
-    main()
+    multiprocessing.freeze_support()   # frozen builds: let spawned children run their target
+    sys.exit(cli())